@@ -0,0 +1,756 @@
+#
+# Benchmarks
+#
+
+import argparse
+import functools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+import telegram
+
+from telegram.ext import Dispatcher
+
+import ftgram
+import replay as feed_replay
+
+_FIXTURE_DIR   = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'fixtures' )
+_PIPELINE_SIZE = ( 10, 100, 1000, 5000 )
+_CHART_MAX     = 100     # charts with more lines are not realistic
+
+# -------------------------------------------------------------------------------------------------
+# Fixtures
+# -------------------------------------------------------------------------------------------------
+
+def make_metric( _num, _seed=0 ):
+
+    # synthetic get_metric() output for _num tickers
+    rng  = np.random.default_rng( _seed )
+    rows = list( ftgram.attr_list.keys() ) + [ 'RSI', 'CCI' ]
+    data = {
+        'regularMarketChangePercent': rng.normal( 0, 0.015, _num ),
+        'regularMarketPrice'        : rng.uniform( 5, 500, _num ),
+        'preMarketChangePercent'    : rng.normal( 0, 0.01, _num ),
+        'preMarketPrice'            : rng.uniform( 5, 500, _num ),
+        'postMarketChangePercent'   : rng.normal( 0, 0.01, _num ),
+        'postMarketPrice'           : rng.uniform( 5, 500, _num ),
+        'RSI'                       : rng.uniform( 10, 90, _num ),
+        'CCI'                       : rng.normal( 0, 100, _num ),
+    }
+    cols = [ f'T{idx:04d}' for idx in range( _num ) ]
+
+    return pd.DataFrame( np.vstack( [ data[ row ] for row in rows ] ), index=rows, columns=cols )
+
+def make_bars( _num, _days=252, _seed=0 ):
+
+    # synthetic ( dates x symbols ) daily bars
+    rng   = np.random.default_rng( _seed )
+    close = 100 * np.cumprod( 1 + rng.normal( 0, 0.02, ( _days, _num ) ), axis=0 )
+    high  = close * ( 1 + rng.uniform( 0, 0.02, ( _days, _num ) ) )
+    low   = close * ( 1 - rng.uniform( 0, 0.02, ( _days, _num ) ) )
+    dates = pd.date_range( end='2024-12-31', periods=_days, freq='B' ).values
+    syms  = [ f'T{idx:04d}' for idx in range( _num ) ]
+
+    return syms, dates, high, low, close
+
+def load_fixtures():
+
+    # recorded Ticker.price, Ticker.history() and one finviz screener page
+    with open( os.path.join( _FIXTURE_DIR, 'price.json' ), 'r' ) as fp:
+        price = json.load( fp )
+    bars = pd.read_csv( os.path.join( _FIXTURE_DIR, 'history.csv' ) )
+    bars['date'] = pd.to_datetime( bars['date'] ).dt.date
+    bars = { symbol: _data.drop( columns='symbol' ).set_index( 'date' ) for symbol, _data in bars.groupby( 'symbol' ) }
+    with open( os.path.join( _FIXTURE_DIR, 'finviz.html' ), 'r' ) as fp:
+        html = fp.read()
+
+    return { 'price': price, 'history': bars, 'finviz': html }
+
+class FakeTicker:
+    """Stands in for yahooquery.Ticker, symbol N replays recorded symbol N % len( fixtures )."""
+
+    fixtures = None
+
+    def __init__( self, symbols, **kwargs ):
+        self.symbols = [ elem.upper() for elem in ( [ symbols ] if isinstance( symbols, str ) else symbols ) ]
+
+    def template( self, _symbol ):
+        names = sorted( self.fixtures['price'].keys() )
+        return names[ sum( map( ord, _symbol ) ) % len( names ) ]
+
+    @property
+    def price( self ):
+        ret = {}
+        for symbol in self.symbols:
+            ret[ symbol ] = dict( self.fixtures['price'][ self.template( symbol ) ], symbol=symbol )
+        return ret
+
+    def history( self, start=None, period=None, interval='1d' ):
+        frames = {}
+        for symbol in self.symbols:
+            _data = self.fixtures['history'][ self.template( symbol ) ]
+            if start is not None: _data = _data[ _data.index >= pd.Timestamp( start ).date() ]
+            frames[ symbol ] = _data
+        return pd.concat( frames, names=[ 'symbol', 'date' ] )
+
+class FakeResponse:
+
+    def __init__( self, _text, _status=200 ):
+        self.text        = _text
+        self.encoding    = 'utf-8'
+        self.status_code = _status
+
+    def raise_for_status( self ):
+        if self.status_code >= 400: raise requests.HTTPError( f'{self.status_code} Error', response=self )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        return False
+
+    def iter_content( self, chunk_size=16384, decode_unicode=True ):
+        for idx in range( 0, len( self.text ), chunk_size ):
+            yield self.text[ idx:idx+chunk_size ]
+
+class FakeSession:
+    """Stands in for finviz_session, serves the recorded page for any row offset."""
+
+    def __init__( self, _html, _total ):
+        self.html = re.sub( r'Total: </b>\d+', f'Total: </b>{_total}', _html )
+
+    def get( self, url, **kwargs ):
+        return FakeResponse( self.html )
+
+class FakeBot( telegram.Bot ):
+    """Records the time of each reply per chat instead of sending it."""
+
+    def __init__( self ):
+        super().__init__( '123456:bench' )
+        self._bot    = telegram.User( 1, 'ftgram', True, username='ftgram_bot' )
+        self.replies = {}
+        self.lock    = threading.Lock()
+
+    def send_message( self, chat_id, text, **kwargs ):
+        with self.lock:
+            self.replies.setdefault( chat_id, [] ).append( time.monotonic() )
+
+def replay( _fixtures, _total=20 ):
+
+    # route ftgram network access to the fixtures
+    FakeTicker.fixtures     = _fixtures
+    ftgram.Ticker           = FakeTicker
+    ftgram.finviz_session   = FakeSession( _fixtures['finviz'], _total )
+    ftgram._HISTORY_DIR     = tempfile.mkdtemp( prefix='bench-history-' )
+
+    return ftgram._HISTORY_DIR
+
+def reset():
+
+    # start cold: no stored bars, quotes, pages or indicator state
+    ftgram.history_store.clear()
+    ftgram.history_fetched.clear()
+    ftgram.history_open.clear()
+    ftgram.intraday_store.clear()
+    ftgram.intraday_fetched.clear()
+    ftgram.indicator_engine.reset()
+    for cache in [ ftgram.quote_cache, ftgram.chart_cache, ftgram.screener_cache ]:
+        with cache.lock:
+            cache.data.clear()
+    shutil.rmtree( ftgram._HISTORY_DIR, ignore_errors=True )
+
+def measure( _func, _repeat, _setup=None ):
+
+    # best latency over _repeat runs, then peak python allocations of one run
+    best = float( 'inf' )
+    for _ in range( _repeat ):
+        if _setup: _setup()
+        start = time.perf_counter()
+        _func()
+        best  = min( best, time.perf_counter() - start )
+
+    if _setup: _setup()
+    tracemalloc.start()
+    _func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return { 'ms': best * 1000, 'peak_kb': peak / 1024 }
+
+def timeit( _func, _repeat ):
+
+    best = float( 'inf' )
+    for _ in range( _repeat ):
+        start = time.perf_counter()
+        _func()
+        best  = min( best, time.perf_counter() - start )
+
+    return best
+
+# -------------------------------------------------------------------------------------------------
+# Benchmarks
+# -------------------------------------------------------------------------------------------------
+
+def bench_filter( _sizes=( 100, 1000, 5000 ), _repeat=5 ):
+
+    print( 'apply_filter' )
+    for num in _sizes:
+        metric = make_metric( num )
+        sec    = timeit( lambda: ftgram.apply_filter( metric ), _repeat )
+        hits   = len( ftgram.apply_filter( metric ) )
+        print( f'  {num:6d} tickers {sec*1000:8.2f} ms {num/sec:12.0f} tickers/s {hits:6d} hits' )
+
+def bench_screener( _sizes=( 500, 3000 ), _repeat=5 ):
+
+    print( 'screener' )
+    for num in _sizes:
+        syms, dates, high, low, close = make_bars( num )
+
+        # cold build seeds every symbol, warm build only applies the last bar
+        scr  = ftgram.Screener()
+        cold = timeit( lambda: scr.build( syms, dates, high, low, close ), 1 )
+        warm = timeit( lambda: scr.build( syms, dates, high, low, close ), _repeat )
+
+        conds = [ ( 'rsi', '<', 30 ), ( 'cci', '<', -100 ) ]
+        query = timeit( lambda: scr.query( conds ), _repeat * 20 )
+        hits  = len( scr.query( conds ) )
+        print( f'  {num:6d} symbols build cold {cold*1000:8.2f} ms warm {warm*1000:8.2f} ms query {query*1000:6.3f} ms {hits:5d} hits' )
+
+def bench_pipeline( _sizes=_PIPELINE_SIZE, _repeat=3 ):
+
+    print( 'pipeline (fixtures)' )
+    fixtures = load_fixtures()
+    tmpdir   = replay( fixtures )
+    results  = {}
+
+    try:
+        for num in _sizes:
+            port = [ f'T{idx:04d}' for idx in range( num ) ]
+            ftgram.finviz_session = FakeSession( fixtures['finviz'], num )
+
+            # stored bars are reused by later stages, as in a running bot
+            stages = {}
+            stages['source_cold'] = measure( lambda: ftgram.get_source( port ), _repeat, reset )
+            info   = ftgram.get_source( port )
+            stages['source_warm'] = measure( lambda: ftgram.get_source( port ), _repeat )
+            stages['metric']      = measure( lambda: ftgram.get_metric( info ), _repeat, ftgram.indicator_engine.reset )
+            metric = ftgram.get_metric( info )
+            stages['filter']      = measure( lambda: ftgram.apply_filter( metric ), _repeat )
+            stages['price']       = measure( lambda: ftgram.get_price( metric ), _repeat )
+            stages['pre']         = measure( lambda: ftgram.get_pre( metric ), _repeat )
+            stages['post']        = measure( lambda: ftgram.get_post( metric ), _repeat )
+            if num <= _CHART_MAX:
+                ftgram.get_chart( info, 12 )     # render process start-up is not measured
+                stages['chart']   = measure( lambda: ftgram.get_chart( info, 12 ), _repeat )
+            url = ftgram.finviz_info['RSI_OVERSOLD(40)']
+            stages['finviz']      = measure( lambda: ftgram.crawl_finviz_df( url ), _repeat, lambda: ftgram.screener_cache.data.clear() )
+
+            for stage, val in stages.items():
+                results.setdefault( stage, {} )[ str( num ) ] = val
+                print( f'  {num:6d} symbols {stage:12} {val["ms"]:10.2f} ms {val["peak_kb"]:10.0f} KiB' )
+    finally:
+        shutil.rmtree( tmpdir, ignore_errors=True )
+
+    return results
+
+_STARTUP_CODE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import ftgram
+ready = time.perf_counter()
+if sys.argv[1] == 'eager':
+    import numpy, pandas, yahooquery, matplotlib.figure
+else:
+    ftgram.warm_modules()
+warm  = time.perf_counter()
+print( json.dumps( { 'import': ready - start, 'warm': warm - start, 'rss': resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss } ) )
+'''
+
+def bench_startup( _sizes=None, _repeat=5 ):
+
+    # fresh interpreter per run, the eager run imports everything up front as before
+    print( 'startup' )
+    cwd     = os.path.dirname( os.path.abspath( __file__ ) )
+    results = {}
+    for mode in [ 'lazy', 'eager' ]:
+        runs = []
+        for _ in range( _repeat ):
+            out = subprocess.run( [ sys.executable, '-c', _STARTUP_CODE, mode ], cwd=cwd, capture_output=True, text=True, check=True )
+            runs.append( json.loads( out.stdout.strip().splitlines()[-1] ) )
+
+        # ready: polling can start, loaded: heavy modules imported
+        ready  = min( elem[ 'import' if mode == 'lazy' else 'warm' ] for elem in runs )
+        loaded = min( elem['warm'] for elem in runs )
+        peak   = max( elem['rss'] for elem in runs )
+        results[ f'ready_{mode}'  ] = { 'all': { 'ms': ready  * 1000, 'peak_kb': peak } }
+        results[ f'loaded_{mode}' ] = { 'all': { 'ms': loaded * 1000, 'peak_kb': peak } }
+        print( f'  {mode:5} ready {ready*1000:8.1f} ms loaded {loaded*1000:8.1f} ms {peak:8d} KiB' )
+
+    return results
+
+_MEMORY_CODE = '''
+import gc, json, os, resource, sys, time
+import bench, ftgram
+np, pd = bench.np, bench.pd
+
+def rss():
+    # resident now, peak where /proc is missing ( KiB )
+    try:
+        with open( '/proc/self/statm' ) as fp:
+            return int( fp.read().split()[1] ) * os.sysconf( 'SC_PAGE_SIZE' ) // 1024
+    except OSError:
+        return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+mode, num = sys.argv[1], int( sys.argv[2] )
+ftgram._HISTORY_DIR = sys.argv[3]
+syms = bench.make_bars( num, 1 )[0]
+before = rss()
+
+# per-symbol frames read from ./history, as the cache held them before
+if mode == 'frames':
+    frames = { symbol: pd.read_pickle( ftgram.get_history_path( symbol ) ) for symbol in syms }
+    read   = lambda: ftgram.PriceMatrix.from_frames( frames )
+else:
+    if mode == 'float32': ftgram.history_store.dtype = 'float32'
+    ftgram.load_history( syms )
+    read   = lambda: ftgram.history_store.matrix( syms )
+gc.collect()
+loaded = rss()
+
+best = float( 'inf' )
+for _ in range( 5 ):
+    start = time.perf_counter()
+    mat   = read()
+    best  = min( best, time.perf_counter() - start )
+print( json.dumps( { 'before': before, 'loaded': loaded, 'read': rss(), 'ms': best * 1000 } ) )
+'''
+
+def bench_memory( _sizes=( 1000, 3000 ), _repeat=None ):
+
+    # fresh interpreter per run: resident daily bars as per-symbol frames ( as before ) and in the store
+    print( 'memory' )
+    cwd     = os.path.dirname( os.path.abspath( __file__ ) )
+    results = {}
+    for num in _sizes:
+        path = tempfile.mkdtemp( prefix='bench-memory-' )
+        syms, dates, high, low, close = make_bars( num )
+        for idx, symbol in enumerate( syms ):
+            pd.DataFrame( { 'open': close[ :, idx ], 'high': high[ :, idx ], 'low': low[ :, idx ], 'close': close[ :, idx ], 'adjclose': close[ :, idx ],
+                            'volume': 1e6 }, index=pd.DatetimeIndex( dates, name='date' ) ).to_pickle( os.path.join( path, f'{symbol}.pkl' ) )
+        try:
+            for mode in [ 'frames', 'store', 'float32' ]:
+                out = subprocess.run( [ sys.executable, '-c', _MEMORY_CODE, mode, str( num ), path ], cwd=cwd, capture_output=True, text=True, check=True )
+                ret = json.loads( out.stdout.strip().splitlines()[-1] )
+
+                # rss before the bars, after loading them, and while a matrix of all of them is held
+                results.setdefault( f'bars_{mode}', {} )[ num ] = { 'ms': ret['ms'], 'peak_kb': ret['read'] - ret['before'] }
+                print( f'  {num:6d} symbols {mode:7} rss before {ret["before"]:8d} KiB loaded {ret["loaded"]:8d} KiB '
+                       f'read {ret["read"]:8d} KiB ( +{ret["read"] - ret["before"]} )  matrix {ret["ms"]:8.2f} ms' )
+        finally:
+            shutil.rmtree( path, ignore_errors=True )
+
+    return results
+
+def bench_push( _sizes=None, _repeat=None, _speed=4.0 ):
+
+    # replay.py -> QuoteFeed -> TickTrigger -> alerts, latency from tick arrival to queued alert
+    print( 'push (replay)' )
+    fixtures = load_fixtures()
+    tmpdir   = replay( fixtures )
+    reset()
+
+    ticks  = feed_replay.load_ticks( feed_replay._FIXTURE )
+    server = feed_replay.ReplayServer( ( '127.0.0.1', 0 ), ticks, _speed )
+    threading.Thread( target=server.serve_forever, daemon=True ).start()
+
+    # one subscribed chat watching the recorded symbols, bars stored as after a first scan
+    symbols = sorted( fixtures['price'].keys() )
+    ftgram.get_source( symbols )
+    patched = { name: getattr( ftgram, name ) for name in [ 'get_chat_port', 'get_chat_params', '_FEED_ADDR' ] }
+    ftgram.get_chat_port   = lambda chat_id: symbols
+    ftgram.get_chat_params = lambda chat_id: ftgram.params
+    ftgram._FEED_ADDR      = server.server_address
+    ftgram.subscribers[1]  = { 'interval': 60, 'next': float( 'inf' ), 'volatile': False }
+
+    # arrival of each symbol's last tick, queued alerts
+    arrival = {}
+    alerts  = []
+    put     = ftgram.tick_trigger.put
+    def on_tick( _symbol ):
+        arrival[ _symbol ] = time.monotonic()
+        put( _symbol )
+    ftgram.quote_feed.on_tick = on_tick
+    ftgram.outbox.put         = lambda chat_id, text, parse_mode=None: alerts.append( ( time.monotonic(), text, dict( arrival ) ) )
+
+    try:
+        ftgram.quote_feed.subscribe( symbols )
+        ftgram.tick_trigger.start()
+        ftgram.quote_feed.start( server.server_address )
+        time.sleep( ticks[-1]['t'] / _speed + ftgram._FEED_DEBOUNCE + 2 )
+    finally:
+        server.shutdown()
+        for name, val in patched.items(): setattr( ftgram, name, val )
+        del ftgram.outbox.put
+        ftgram.subscribers.clear()
+        shutil.rmtree( tmpdir, ignore_errors=True )
+
+    lat = []
+    for at, text, seen in alerts:
+        for line in text.split( '\n' ):
+            symbol = re.search( r'\[(\S+)\s*\]', line ).group( 1 )
+            lat.append( at - seen[ symbol ] )
+            print( f'  {line}' )
+
+    st = ftgram.quote_feed.stats()
+    print( f'  {st["ticks"]} ticks, {len( lat )} alerts, last tick to alert {np.mean( lat )*1000 if lat else 0:.1f} ms avg {max( lat, default=0 )*1000:.1f} ms max (debounce {ftgram._FEED_DEBOUNCE*1000:.0f} ms)' )
+
+    return { 'tick_to_alert': { 'all': { 'ms': float( np.mean( lat ) * 1000 ) if lat else 0.0, 'peak_kb': 0 } } }
+
+def shard_setup( _quotes ):
+
+    # runs in every shard process
+    replay( load_fixtures() )
+    ftgram._SHARED_QUOTES = _quotes
+    ftgram.shared_quotes  = ftgram.SharedQuotes( _quotes )
+
+def bench_shards( _sizes=( 1000, ), _repeat=3, _counts=( 0, 1, 2, 4 ), _clients=8 ):
+
+    # concurrent requests, each for its own slice of the watchlist
+    print( f'shards ({os.cpu_count()} cpus)' )
+    fixtures = load_fixtures()
+    tmpdir   = replay( fixtures )
+    quotes   = os.path.join( tempfile.mkdtemp( prefix='bench-quotes-' ), 'quotes.db' )
+    results  = {}
+
+    try:
+        for num in _sizes:
+            port  = [ f'T{idx:04d}' for idx in range( num ) ]
+            parts = [ port[ idx::_clients ] for idx in range( _clients ) ]
+            for count in _counts:
+                reset()
+                ftgram.quote_cache.data.clear()
+                ftgram.start_shards( count, functools.partial( shard_setup, quotes ) )
+                if count == 0: shard_setup( quotes )
+
+                # stored bars and warm processes first
+                ftgram.source_metric( port )
+                with ThreadPoolExecutor( max_workers=_clients ) as pool:
+                    run = lambda: list( pool.map( lambda elem: ftgram.source_metric( elem, _fetch=False ), parts ) )
+                    sec = timeit( run, _repeat )
+                ftgram.stop_shards()
+                ftgram.shared_quotes = None
+
+                results.setdefault( f'shards_{count}', {} )[ str( num ) ] = { 'ms': sec * 1000, 'peak_kb': 0 }
+                print( f'  {num:6d} symbols {count:2d} shards {sec*1000:10.2f} ms {num/sec:10.0f} symbols/s' )
+    finally:
+        shutil.rmtree( tmpdir, ignore_errors=True )
+        shutil.rmtree( os.path.dirname( quotes ), ignore_errors=True )
+
+    return results
+
+# -------------------------------------------------------------------------------------------------
+# Results
+# -------------------------------------------------------------------------------------------------
+
+def post_update( _url, _update, _num, _retry=True ):
+
+    # every post gets its own chat, so the reply can be matched to it
+    chat_id = 100000 + _num
+    message = dict( _update['message'], chat=dict( _update['message']['chat'], id=chat_id ), message_id=_num )
+    start   = time.monotonic()
+    refused = 0
+    while True:
+        resp = requests.post( _url, json={ 'update_id': _num, 'message': message }, timeout=30 )
+        if resp.status_code != 503 or not _retry: break
+        # like telegram, deliver it again after Retry-After
+        refused += 1
+        time.sleep( float( resp.headers.get( 'Retry-After', 1 ) ) )
+
+    return chat_id, start, resp.status_code, refused + ( resp.status_code == 503 )
+
+def bench_webhook( _sizes=( 200, ), _repeat=None, _clients=8, _burst=( 2, 4 ) ):
+
+    # recorded updates posted to a local webhook, latency from the post to the bot's reply
+    print( 'webhook' )
+    fixtures = load_fixtures()
+    tmpdir   = replay( fixtures )
+    statedir = tempfile.mkdtemp( prefix='bench-state-' )
+    reset()
+
+    with open( os.path.join( _FIXTURE_DIR, 'updates.jsonl' ), 'r' ) as fp:
+        updates = [ json.loads( line ) for line in fp if line.strip() ]
+
+    bot        = FakeBot()
+    dispatcher = Dispatcher( bot, None, workers=1 )
+    ftgram.add_handlers( dispatcher, _run_async=False )
+    patched    = ftgram.state_store
+    ftgram.state_store = ftgram.StateStore( os.path.join( statedir, 'state.db' ), ftgram.params )
+
+    def run( _hook, _num, _clients, _retry=True ):
+        url = f'http://127.0.0.1:{_hook.server.server_address[1]}/hook'
+        bot.replies.clear()
+        with ThreadPoolExecutor( max_workers=_clients ) as pool:
+            posts = list( pool.map( lambda idx: post_update( url, updates[ idx % len( updates ) ], idx, _retry ), range( _num ) ) )
+
+        # accepted updates are answered exactly once
+        accepted = [ elem for elem in posts if elem[2] == 200 ]
+        deadline = time.monotonic() + 60
+        while len( bot.replies ) < len( accepted ) and time.monotonic() < deadline:
+            time.sleep( 0.01 )
+        lat = [ bot.replies[ chat_id ][0] - start for chat_id, start, _, _ in accepted if chat_id in bot.replies ]
+
+        return lat, sum( elem[3] for elem in posts )
+
+    results = {}
+    try:
+        hook = ftgram.Webhook()
+        hook.start( dispatcher, ( '127.0.0.1', 0 ), '/hook' )
+        run( hook, len( updates ), 1 )      # stored bars first
+        for num in _sizes:
+            start = time.monotonic()
+            lat, refused = run( hook, num, _clients )
+            sec   = time.monotonic() - start
+            p50, p95 = np.percentile( lat, [ 50, 95 ] ) * 1000
+            results.setdefault( 'p50', {} )[ str( num ) ] = { 'ms': float( p50 ), 'peak_kb': 0 }
+            results.setdefault( 'p95', {} )[ str( num ) ] = { 'ms': float( p95 ), 'peak_kb': 0 }
+            print( f'  {num:6d} updates {_clients:2d} clients {p50:8.1f} ms p50 {p95:8.1f} ms p95 {num/sec:8.1f} updates/s {refused} retried after 503' )
+        hook.stop()
+
+        # saturated workers: the queue fills and the rest is refused right away
+        workers, depth = _burst
+        hook = ftgram.Webhook( workers, depth )
+        hook.start( dispatcher, ( '127.0.0.1', 0 ), '/hook' )
+        num  = max( _sizes )
+        lat, refused = run( hook, num, _clients * 4, _retry=False )
+        hook.stop()
+        print( f'  {num:6d} updates {_clients*4:2d} clients {workers} workers queue {depth}: {num - refused} handled, {refused} refused with 503' )
+    finally:
+        ftgram.state_store = patched
+        shutil.rmtree( tmpdir, ignore_errors=True )
+        shutil.rmtree( statedir, ignore_errors=True )
+
+    return results
+
+def save_results( _path, _results ):
+
+    meta = {
+        'time'    : time.strftime( '%Y-%m-%d %H:%M:%S' ),
+        'python'  : platform.python_version(),
+        'numpy'   : np.__version__,
+        'pandas'  : pd.__version__,
+        'machine' : platform.machine(),
+    }
+    with open( _path, 'w' ) as fp:
+        json.dump( { 'meta': meta, 'results': _results }, fp, indent=1 )
+
+def compare_results( _path, _results, _tolerance=0.10 ):
+
+    # latency change against a saved run, slower than tolerance is flagged
+    with open( _path, 'r' ) as fp:
+        base = json.load( fp )['results']
+
+    print( f'compared to {_path}' )
+    slower = 0
+    for name, stages in _results.items():
+        for stage, sizes in stages.items():
+            for num, val in sizes.items():
+                prev = base.get( name, {} ).get( stage, {} ).get( num )
+                if prev is None: continue
+                ratio = val['ms'] / prev['ms'] - 1 if prev['ms'] > 0 else 0.0
+                flag  = ' <<' if ratio > _tolerance else ''
+                slower += ratio > _tolerance
+                print( f'  {name:8} {stage:12} {num:>6} {prev["ms"]:10.2f} -> {val["ms"]:10.2f} ms ({ratio*100:+6.1f}%){flag}' )
+
+    return slower
+
+def record( _symbols=( 'AAPL', 'MSFT', 'SPY', 'TSLA' ) ):
+
+    # refresh fixtures from the live services
+    from yahooquery import Ticker
+    tick = Ticker( list( _symbols ), verify=False )
+    with open( os.path.join( _FIXTURE_DIR, 'price.json' ), 'w' ) as fp:
+        json.dump( tick.price, fp, indent=1, default=str )
+    bars = tick.history( period='1y', interval='1d' ).reset_index()
+    bars['date'] = [ elem.date() if hasattr( elem, 'date' ) else elem for elem in bars['date'] ]
+    bars.to_csv( os.path.join( _FIXTURE_DIR, 'history.csv' ), index=False )
+    with ftgram.finviz_session.get( ftgram.finviz_info['RSI_OVERSOLD(40)'], timeout=10, verify=False ) as website:
+        with open( os.path.join( _FIXTURE_DIR, 'finviz.html' ), 'w' ) as fp:
+            fp.write( website.text )
+
+# -------------------------------------------------------------------------------------------------
+# Parity
+# -------------------------------------------------------------------------------------------------
+
+def talib_last( _talib, _high, _low, _close ):
+
+    # reference RSI and CCI of each column's last bar, missing bars dropped
+    rsi = np.full( _close.shape[1], np.nan )
+    cci = np.full( _close.shape[1], np.nan )
+    for col in range( _close.shape[1] ):
+        ok = ~( np.isnan( _high[ :, col ] ) | np.isnan( _low[ :, col ] ) | np.isnan( _close[ :, col ] ) )
+        if ok.sum() < 2: continue
+        high, low, close = _high[ ok, col ], _low[ ok, col ], _close[ ok, col ]
+        rsi[ col ] = _talib.RSI( close, timeperiod=ftgram._RSI_PERIOD )[-1]
+        cci[ col ] = _talib.CCI( high, low, close, timeperiod=ftgram._CCI_PERIOD )[-1]
+
+    return rsi, cci
+
+class ParityCase:
+    """Feeds bars to one IndicatorEngine and compares every result with TA-Lib."""
+
+    def __init__( self, _talib, _name, _tol ):
+        self.talib  = _talib
+        self.name   = _name
+        self.tol    = _tol
+        self.engine = ftgram.IndicatorEngine()
+        self.checks = 0
+        self.bad    = 0
+        self.diff   = 0.0
+
+    def check( self, _keys, _dates, _high, _low, _close ):
+        got = self.engine.update_many( _keys, _dates, _high, _low, _close )
+        ref = talib_last( self.talib, _high, _low, _close )
+        for val, exp in zip( got, ref ):
+            both = ~np.isnan( val ) & ~np.isnan( exp )
+            diff = np.abs( val[ both ] - exp[ both ] )
+            self.checks += len( val )
+            self.bad    += int( np.sum( np.isnan( val ) != np.isnan( exp ) ) + np.sum( diff > self.tol ) )
+            self.diff    = max( self.diff, float( diff.max() ) if len( diff ) else 0.0 )
+
+    def report( self ):
+        print( f'  {self.name:10} {self.checks:7d} values  max diff {self.diff:.1e}  {self.bad} mismatches' )
+        return self.bad == 0
+
+def gappy_bars( _days=160, _seed=1 ):
+
+    # full, late listed, missing days and short histories around the indicator periods
+    syms, dates, high, low, close = make_bars( 12, _days, _seed )
+    rng = np.random.default_rng( _seed )
+    for field in ( high, low, close ):
+        field[ :100, 1 ] = np.nan
+    holes = rng.uniform( size=_days ) < 0.1
+    for col, num in enumerate( [ 1, 2, 14, 15, 16, 17, 28, 29 ], start=2 ):
+        for field in ( high, low, close ):
+            field[ :_days-num, col ] = np.nan
+    for field in ( high, low, close ):
+        field[ holes, 10 ] = np.nan
+    close[ rng.uniform( size=_days ) < 0.1, 11 ] = np.nan
+
+    return syms, dates, high, low, close
+
+def parity( _tol=1e-8 ):
+
+    # IndicatorEngine against talib.RSI / talib.CCI, dev dependency ( requirements-dev.txt )
+    try:
+        import talib
+    except ImportError:
+        print( 'parity needs ta-lib: pip install -r requirements-dev.txt' )
+        return False
+
+    print( f'parity (ta-lib {talib.__version__})' )
+    cases = []
+
+    # cold start over the recorded bars and synthetic ones
+    mat  = ftgram.PriceMatrix.from_frames( load_fixtures()['history'], dtype='float64' )
+    case = ParityCase( talib, 'cold', _tol )
+    case.check( mat.symbols, mat.dates, mat.take( 'high' ), mat.take( 'low' ), mat.take( 'close' ) )
+    case.check( *make_bars( 200, _seed=2 ) )
+    cases.append( case )
+
+    # one bar at a time, warm state only advances
+    syms, dates, high, low, close = make_bars( 20, 120, _seed=3 )
+    case = ParityCase( talib, 'append', _tol )
+    for row in range( 2, len( dates ) + 1 ):
+        case.check( syms, dates[ :row ], high[ :row ], low[ :row ], close[ :row ] )
+    cases.append( case )
+
+    # today's bar changes between calls, only its final value may be committed
+    case = ParityCase( talib, 'revise', _tol )
+    for row in range( 2, len( dates ) + 1 ):
+        for move in ( 0.97, 1.04, 1.0 ):
+            last = lambda x: np.vstack( [ x[ :row-1 ], x[ row-1:row ] * move ] )
+            case.check( syms, dates[ :row ], last( high ), last( low ), last( close ) )
+    cases.append( case )
+
+    # split or dividend: every past bar is re-adjusted, then one more bar arrives
+    case = ParityCase( talib, 'rescale', _tol )
+    for row in range( 2, 101 ):
+        case.check( syms, dates[ :row ], high[ :row ], low[ :row ], close[ :row ] )
+    scale = np.where( np.arange( len( dates ) )[ :, None ] < 100, 0.25, 1.0 )
+    for row in range( 101, len( dates ) + 1 ):
+        case.check( syms, dates[ :row ], high[ :row ] * scale[ :row ], low[ :row ] * scale[ :row ], close[ :row ] * scale[ :row ] )
+    cases.append( case )
+
+    # missing days, late listings and short histories, cold and appended
+    syms, dates, high, low, close = gappy_bars()
+    case = ParityCase( talib, 'gaps', _tol )
+    case.check( syms, dates, high, low, close )
+    for row in range( 2, len( dates ) + 1 ):
+        case.check( syms, dates[ :row ], high[ :row ], low[ :row ], close[ :row ] )
+    cases.append( case )
+
+    return all( [ case.report() for case in cases ] )
+
+# -------------------------------------------------------------------------------------------------
+# Main
+# -------------------------------------------------------------------------------------------------
+
+benchmarks = {
+    'filter'  : bench_filter,
+    'screener': bench_screener,
+    'pipeline': bench_pipeline,
+    'startup' : bench_startup,
+    'memory'  : bench_memory,
+    'push'    : bench_push,
+    'shards'  : bench_shards,
+    'webhook' : bench_webhook,
+}
+
+def main():
+
+    parser = argparse.ArgumentParser( description='ftgram benchmarks, offline' )
+    parser.add_argument( 'names', nargs='*', help=f'{", ".join( benchmarks )}, record or parity (default: all benchmarks)' )
+    parser.add_argument( '--sizes', type=int, nargs='+', help='watchlist sizes' )
+    parser.add_argument( '--repeat', type=int, help='runs per measurement, best is kept' )
+    parser.add_argument( '--save', help='write results as json' )
+    parser.add_argument( '--compare', help='compare with results saved by --save' )
+    args = parser.parse_args()
+
+    if args.names == [ 'record' ]:
+        record()
+        return
+
+    if args.names == [ 'parity' ]:
+        sys.exit( 0 if parity() else 1 )
+
+    kwargs = {}
+    if args.sizes:  kwargs['_sizes']  = tuple( args.sizes )
+    if args.repeat: kwargs['_repeat'] = args.repeat
+
+    results = {}
+    for name in args.names or list( benchmarks.keys() ):
+        ret = benchmarks[ name ]( **kwargs )
+        if ret: results[ name ] = ret
+
+    slower = compare_results( args.compare, results ) if args.compare else 0
+    if args.save: save_results( args.save, results )
+
+    # non-zero exit on regressions
+    sys.exit( 1 if slower else 0 )
+
+if __name__ == '__main__':
+    main()
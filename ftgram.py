@@ -10,33 +10,191 @@ urllib3.disable_warnings( urllib3.exceptions.InsecureRequestWarning )
 # Imports
 # -------------------------------------------------------------------------------------------------
 
-import talib as ta
-import pandas as pd
+import argparse
 import os
+import copy
+import importlib
+import io
 import json
 import requests
+import random
 import re
-
-import matplotlib as mat
-
-# use agg backend to suppress warnings
-mat.use('agg')
+import secrets
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from queue import Queue, Full
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
 
 from telegram import Update
 from telegram.ext import Updater, CommandHandler, CallbackContext
+from telegram.error import BadRequest, ChatMigrated, NetworkError, RetryAfter, TelegramError, Unauthorized
 
-from yahooquery import Ticker
-from numpy import isnan
-from bs4 import BeautifulSoup
-from datetime import datetime, timezone
+from datetime import datetime, date, timedelta
+from zoneinfo import ZoneInfo
 from dateutil.relativedelta import relativedelta
 
+# -------------------------------------------------------------------------------------------------
+# Lazy imports
+# -------------------------------------------------------------------------------------------------
+
+class LazyModule:
+    """Stands in for a module (or one of its attributes) until first use, then replaces itself in globals()."""
+
+    def __init__( self, alias, module, attr=None ):
+        self.alias  = alias
+        self.module = module
+        self.attr   = attr
+
+    def load( self ):
+        # importlib serializes concurrent imports of one module
+        value = importlib.import_module( self.module )
+        if self.attr is not None: value = getattr( value, self.attr )
+        if globals().get( self.alias ) is self: globals()[ self.alias ] = value
+        return value
+
+    def __getattr__( self, key ):
+        return getattr( self.load(), key )
+
+    def __call__( self, *args, **kwargs ):
+        return self.load()( *args, **kwargs )
+
+# heavy modules, most commands only need some of them
+np     = LazyModule( 'np',     'numpy'   )
+pd     = LazyModule( 'pd',     'pandas'  )
+Ticker = LazyModule( 'Ticker', 'yahooquery', 'Ticker' )
+
+def warm_modules():
+
+    # import in the background once polling runs, so the first command does not pay for it
+    for elem in [ 'np', 'pd', 'Ticker' ]:
+        if isinstance( globals()[ elem ], LazyModule ): globals()[ elem ].load()
+
 # -------------------------------------------------------------------------------------------------
 # Globals
 # -------------------------------------------------------------------------------------------------
 
 _TOKEN_PATH      = './token.txt'
-_PARAM_FILE      = './param.json'
+_PARAM_FILE      = './param.json'     # legacy single-chat file, used as defaults if present
+_STATE_FILE      = './state.db'
+_HISTORY_DIR     = './history'
+_HISTORY_YEARS   = 1
+_HISTORY_TTL     = 60      # seconds stored bars are used without fetching the tail again
+_HISTORY_DTYPE   = 'float64'    # 'float32' halves memory, at some precision cost
+
+_INTRADAY_DAYS   = 7       # days of 1m bars kept (about 5 sessions)
+_INTRADAY_TTL    = 60      # seconds 1m bars are used without fetching again
+_INTERVALS       = {       # supported bar sizes: pandas resample rule
+    '1m' : None,
+    '5m' : '5min',
+    '15m': '15min',
+    '1h' : '60min',
+    '1d' : None,
+}
+
+_QUOTE_CACHE_SIZE = 2000
+_QUOTE_TTL_OPEN   = 15      # seconds, while any session ( pre, regular, post ) trades
+_QUOTE_TTL_CLOSED = 300     # seconds, otherwise
+_QUOTE_OPEN_STATES = [ 'PREPRE', 'PRE', 'REGULAR', 'POST', 'POSTPOST' ]   # yahoo marketState
+
+_WORKERS         = 8       # concurrent command handlers
+_IO_WORKERS      = 16      # concurrent upstream requests
+
+_RENDER_WORKERS  = 2       # chart rendering processes
+_RENDER_TASKS    = 500     # renders before a rendering process is replaced
+_RENDER_TIMEOUT  = 60      # seconds
+_CHART_CACHE_SIZE = 200    # rendered charts kept in memory
+
+_SCREENER_TTL    = 300     # seconds a screener page is reused
+_SCREENER_CACHE  = 64      # screener pages kept in memory
+_SCREENER_ROWS   = 10      # default rows for /oversold, /overbought
+_SCREENER_MAX    = 100     # max rows for /oversold, /overbought, /screen
+
+_UNIVERSE_FILE   = './universe.txt'   # symbols for the local screener, one per line
+_UNIVERSE_JOB    = 'universe'
+_UNIVERSE_SNAP   = './history/_universe'   # last universe bars, memory-mapped at startup
+_UNIVERSE_REFRESH = 900    # seconds between screener refreshes
+
+_FETCH_WORKERS   = 8       # concurrent chunk requests
+_FETCH_CHUNK     = 50      # symbols per upstream request
+_FETCH_RETRIES   = 3       # attempts per chunk before it is split
+_FETCH_SPLITS    = 3       # times a failing chunk is halved to isolate bad symbols
+_FETCH_BACKOFF   = 0.5     # seconds, doubled per retry with jitter
+
+_STREAM_WORKERS  = 4       # concurrent chunks of one streamed reply
+_STREAM_CHUNK    = 25      # tickers per streamed chunk
+_EDIT_INTERVAL   = 1.5     # seconds between edits of a streamed reply
+_MESSAGE_LIMIT   = 4096    # telegram message length
+
+_SEND_RATE       = 25      # messages per second, all chats
+_SEND_BURST      = 30      # messages sent back to back at most
+_CHAT_INTERVAL   = 1.0     # seconds between messages to one private chat
+_GROUP_INTERVAL  = 3.0     # seconds between messages to one group
+_SEND_BACKOFF    = 1.0     # seconds to wait after a network error, doubled for each one in a row
+_SEND_BACKOFF_MAX = 60.0    # seconds, at most
+
+_SCAN_TICK       = 10      # seconds, /run intervals are rounded up to multiples of this
+_SCAN_JOB        = 'scan'
+
+_MARKET_TZ       = ZoneInfo( 'America/New_York' )
+_HOLIDAY_FILE    = './holidays.txt'   # exchange holidays, 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM' for early closes
+_SESSIONS        = {       # local exchange time
+    'pre'    : ( '04:00', '09:30' ),
+    'regular': ( '09:30', '16:00' ),
+    'post'   : ( '16:00', '20:00' ),
+}
+_SESSION_FACTOR  = {       # /run interval multiplier per session, None pauses polling
+    'pre'    : 2,
+    'regular': 1,
+    'post'   : 2,
+    'closed' : None,
+}
+_VOLATILE_MOVE   = 0.03    # daily change of any watched ticker that tightens polling
+_VOLATILE_SPEEDUP = 2      # interval divisor while volatile, regular session only
+
+_FEED_ADDR       = None    # ( host, port ) of a pushed quote stream, e.g. ( '127.0.0.1', 8765 ) for replay.py
+_FEED_STALE      = 60      # seconds a pushed quote is used instead of polling
+_FEED_DEBOUNCE   = 1.0     # seconds ticks are batched before alerts are evaluated
+_FEED_RECONNECT  = 5       # seconds between connection attempts
+
+_SHARDS          = 0       # worker processes for metrics and charts, 0 keeps them in the bot process (--shards)
+_SHARED_QUOTES   = './quotes.db'      # quotes shared by the shard processes
+
+_WEBHOOK_HOST    = '127.0.0.1'        # local address of the webhook server, behind a tls proxy (--host)
+_WEBHOOK_PORT    = 8443    # (--port)
+_WEBHOOK_WORKERS = 8       # threads handling webhook updates
+_WEBHOOK_QUEUE   = 64      # updates waiting for a worker before requests are refused
+_WEBHOOK_RETRY   = 1       # Retry-After seconds of a refused update
+_WEBHOOK_BODY    = 1 << 20 # largest accepted update in bytes
+
+_ALERT_COOLDOWN  = 900     # seconds before the same ( symbol, rule ) alert is sent again
+_ALERT_HYSTERESIS = {      # band an alert must clear before it ends, in measure units
+    'RSI'                       : 2.0,
+    'CCI'                       : 10.0,
+    'regularMarketChangePercent': 0.002,
+    'preMarketChangePercent'    : 0.002,
+    'postMarketChangePercent'   : 0.002,
+}
+
+_STATS_ENABLED   = True    # stage timing for /stats, a no-op when False
+_STATS_PORT      = None    # e.g. 9464 serves /metrics on 127.0.0.1
+_ADMIN_FILE      = './admin.txt'   # chat ids allowed to use /stats, one per line
+
+_RSI_PERIOD      = 14
+_CCI_PERIOD      = 14
 
 _DEFAULT_PORT    = [ 'SPY', 'QQQ' ]
 _RSI_THRESHOLD_L = 35
@@ -59,7 +217,10 @@ params = {
     'DAY_L'  : _DAY_THRESHOLD_L,
     'DAY_H'  : _DAY_THRESHOLD_H,
 }
-# filtername: [ measure, threshold, pos/neg factor, percentage factor ]
+# filtername: [ measure, threshold, pos/neg factor, percentage factor(, tickers) ]
+# threshold is either a params key or a literal value, e.g.
+#   'CCIUp'     : [ 'CCI',                'CCI_H',  1, 1 ]
+#   'AAPLAbove' : [ 'regularMarketPrice', 200.0,    1, 1, [ 'AAPL' ] ]
 filter_dict = {
     'DailyChangeUp': [ 'regularMarketChangePercent', 'DAY_H',  1, 100 ],
     'DailyChangeDn': [ 'regularMarketChangePercent', 'DAY_L', -1, 100 ],
@@ -97,7 +258,957 @@ finviz_info = {
     'RSI_OVERBOUGHT(60)': 'https://finviz.com/screener.ashx?v=171&f=ta_rsi_ob60&ft=3&o=-marketcap',   
 }
 
-prev_desc = []
+# /run subscribers: chat_id -> { 'interval', 'next', 'volatile' }
+subscribers      = {}
+subscribers_lock = threading.Lock()
+
+# exchange calendar: date -> early close 'HH:MM', or None when closed all day
+holidays = {}
+
+# blocking network calls run here so independent requests overlap
+io_executor = ThreadPoolExecutor( max_workers=_IO_WORKERS, thread_name_prefix='io' )
+
+# keep-alive connections to finviz, shared by all requests
+finviz_session = requests.Session()
+finviz_session.mount( 'https://', HTTPAdapter( pool_connections=4, pool_maxsize=_IO_WORKERS ) )
+finviz_session.mount( 'http://',  HTTPAdapter( pool_connections=4, pool_maxsize=_IO_WORKERS ) )
+finviz_session.headers.update( headers )
+
+# chart rendering processes, started on first /draw
+render_pool      = None
+render_pool_lock = threading.Lock()
+
+# shard processes, and the index of the current one inside a shard
+shards           = []
+shard_id         = None
+
+# per rendering process, reused between charts
+render_figure    = None
+
+# chunk requests, separate from io_executor since io tasks wait on them
+fetch_executor = ThreadPoolExecutor( max_workers=_FETCH_WORKERS, thread_name_prefix='fetch' )
+
+# chunks of streamed replies, each one runs a full get_source
+stream_executor = ThreadPoolExecutor( max_workers=_STREAM_WORKERS, thread_name_prefix='stream' )
+
+# daily and 1m bars live in history_store and intraday_store ( Bars )
+history_fetched = {}        # symbol -> time of the last tail fetch
+history_open  = {}          # symbol -> date of the stored bar that was unfinished when written
+history_lock  = threading.Lock()
+
+intraday_fetched = {}       # symbol -> time of the last 1m fetch
+intraday_lock  = threading.Lock()
+
+# -------------------------------------------------------------------------------------------------
+# Cache
+# -------------------------------------------------------------------------------------------------
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry and coalescing of concurrent misses."""
+
+    def __init__( self, max_size, ttl=None ):
+        self.max_size = max_size
+        self.ttl      = ttl         # seconds, callable( value ) or None (never expires)
+        self.data     = OrderedDict()
+        self.flights  = {}          # key -> [ event, value ] for fetches in progress
+        self.lock     = threading.Lock()
+        self.hits     = 0
+        self.misses   = 0
+
+    def _expiry( self, value, ttl ):
+        ttl = self.ttl if ttl is None else ttl
+        if callable( ttl ): ttl = ttl( value )
+        if ttl is None: return float( 'inf' )
+        return time.monotonic() + ttl
+
+    def _lookup( self, key ):
+        # caller holds the lock
+        if key not in self.data: return False, None
+        value, expiry = self.data[ key ]
+        if expiry < time.monotonic():
+            del self.data[ key ]
+            return False, None
+        self.data.move_to_end( key )
+        return True, value
+
+    def _store( self, key, value, ttl ):
+        # caller holds the lock
+        expiry = self._expiry( value, ttl )
+        if expiry <= time.monotonic(): return
+        self.data[ key ] = ( value, expiry )
+        self.data.move_to_end( key )
+        while len( self.data ) > self.max_size:
+            self.data.popitem( last=False )
+
+    def get( self, key, default=None ):
+        with self.lock:
+            found, value = self._lookup( key )
+            if found: self.hits += 1
+            else:     self.misses += 1
+        return value if found else default
+
+    def peek( self, key, default=None ):
+        # lookup that leaves the hit counters and the LRU order alone
+        with self.lock:
+            elem = self.data.get( key )
+        if elem is None or elem[1] < time.monotonic(): return default
+        return elem[0]
+
+    def put( self, key, value, ttl=None ):
+        with self.lock:
+            self._store( key, value, ttl )
+
+    def get_many( self, keys, fetch, ttl=None ):
+        """Return { key: value } for keys, calling fetch( missing_keys ) -> dict once for misses."""
+        result = {}
+        mine   = []
+        others = {}
+
+        with self.lock:
+            for key in keys:
+                found, value = self._lookup( key )
+                if found:
+                    self.hits += 1
+                    result[ key ] = value
+                elif key in self.flights:
+                    self.hits += 1
+                    others[ key ] = self.flights[ key ]
+                else:
+                    self.misses += 1
+                    self.flights[ key ] = [ threading.Event(), None ]
+                    mine.append( key )
+
+        # fetch own misses in a single call
+        if mine:
+            fetched = {}
+            try:
+                fetched = fetch( mine )
+            finally:
+                with self.lock:
+                    flights = [ ( key, self.flights.pop( key ) ) for key in mine ]
+                    for key, flight in flights:
+                        if key in fetched: flight[1] = fetched[ key ]
+                        flight[0].set()
+                    for key in mine:
+                        if key in fetched: self._store( key, fetched[ key ], ttl )
+            result.update( { key: fetched[ key ] for key in mine if key in fetched } )
+
+        # wait for fetches started by other threads
+        for key, flight in others.items():
+            flight[0].wait()
+            if flight[1] is not None: result[ key ] = flight[1]
+
+        return result
+
+    def stats( self ):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size'   : len( self.data ),
+                'hits'   : self.hits,
+                'misses' : self.misses,
+                'ratio'  : self.hits / total if total > 0 else 0.0,
+            }
+
+def quote_ttl( _quote ):
+
+    # error messages are not cached
+    if not isinstance( _quote, dict ): return 0
+    # pre and post market prices move as well, /pre and /post alerts need them fresh
+    if _quote.get( 'marketState' ) in _QUOTE_OPEN_STATES: return _QUOTE_TTL_OPEN
+    return _QUOTE_TTL_CLOSED
+
+quote_cache = TTLCache( _QUOTE_CACHE_SIZE, ttl=quote_ttl )
+
+# rendered charts: { 'png', 'file_id' }, replaced when new bars arrive
+chart_cache = TTLCache( _CHART_CACHE_SIZE )
+
+# parsed screener pages by url
+screener_cache = TTLCache( _SCREENER_CACHE, ttl=_SCREENER_TTL )
+
+class SharedQuotes:
+    """Quotes in SQLite, shared by the bot and its shard processes."""
+
+    def __init__( self, path ):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect( self ):
+        # caller holds the lock
+        if self.conn is None:
+            self.conn = sqlite3.connect( self.path, timeout=10, check_same_thread=False )
+            self.conn.execute( 'PRAGMA journal_mode=WAL' )
+            self.conn.execute( 'CREATE TABLE IF NOT EXISTS quotes ( symbol TEXT PRIMARY KEY, quote TEXT NOT NULL, expiry REAL NOT NULL )' )
+            self.conn.commit()
+        return self.conn
+
+    def get_many( self, keys, chunk=500 ):
+        ret = {}
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            for idx in range( 0, len( keys ), chunk ):
+                part = keys[ idx:idx+chunk ]
+                rows = conn.execute( f'SELECT symbol, quote FROM quotes WHERE expiry > ? AND symbol IN ( {",".join( "?" * len( part ) )} )', ( now, *part ) )
+                ret.update( { symbol: json.loads( quote ) for symbol, quote in rows } )
+        return ret
+
+    def put_many( self, quotes, ttl=quote_ttl ):
+        # error messages expire at once and are not stored
+        now  = time.time()
+        rows = [ ( key, json.dumps( val, default=str ), now + ttl( val ) ) for key, val in quotes.items() if isinstance( val, dict ) and ttl( val ) > 0 ]
+        if not rows: return
+        with self.lock:
+            with self.connect() as conn:
+                conn.executemany( 'INSERT OR REPLACE INTO quotes ( symbol, quote, expiry ) VALUES ( ?, ?, ? )', rows )
+
+# set in shard mode, by start_shards() and in every shard process
+shared_quotes = None
+
+# -------------------------------------------------------------------------------------------------
+# Stats
+# -------------------------------------------------------------------------------------------------
+
+class StageTimer:
+
+    def __init__( self, stats, command, stage ):
+        self.stats   = stats
+        self.command = command
+        self.stage   = stage
+
+    def __enter__( self ):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__( self, *args ):
+        self.stats.observe( self.command, self.stage, time.perf_counter() - self.start )
+        return False
+
+class StageStats:
+    """Latency histograms per ( command, stage ), time() is a shared no-op when disabled."""
+
+    buckets = ( 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0 )
+
+    def __init__( self, enabled=True ):
+        self.enabled = enabled
+        self.data    = {}           # ( command, stage ) -> [ bucket counts, count, sum, max ]
+        self.lock    = threading.Lock()
+        self.local   = threading.local()
+        self.null    = nullcontext()
+
+    def current( self ):
+        # command of the calling handler thread
+        return getattr( self.local, 'command', 'other' )
+
+    def time( self, stage, command=None ):
+        if not self.enabled: return self.null
+        return StageTimer( self, command or self.current(), stage )
+
+    def observe( self, command, stage, seconds ):
+        idx = bisect_left( self.buckets, seconds )
+        with self.lock:
+            elem = self.data.get( ( command, stage ) )
+            if elem is None:
+                elem = self.data[ ( command, stage ) ] = [ [ 0 ] * ( len( self.buckets ) + 1 ), 0, 0.0, 0.0 ]
+            elem[0][ idx ] += 1
+            elem[1]        += 1
+            elem[2]        += seconds
+            elem[3]         = max( elem[3], seconds )
+
+    def wrap( self, command, callback ):
+        # handler that records its total time, and tags its stages with command
+        if not self.enabled: return callback
+
+        def timed( update, context ):
+            self.local.command = command
+            try:
+                with StageTimer( self, command, 'total' ):
+                    return callback( update, context )
+            finally:
+                self.local.command = 'other'
+
+        return timed
+
+    def quantile( self, counts, total, q ):
+        # upper bound of the bucket holding the q-th observation
+        rank = q * total
+        acc  = 0
+        for idx, num in enumerate( counts ):
+            acc += num
+            if acc >= rank: return self.buckets[ idx ] if idx < len( self.buckets ) else float( 'inf' )
+        return float( 'inf' )
+
+    def summary( self ):
+        with self.lock:
+            items = sorted( ( key, [ list( val[0] ) ] + val[1:] ) for key, val in self.data.items() )
+
+        ret = []
+        for ( command, stage ), ( counts, total, acc, top ) in items:
+            ret.append( {
+                'command': command,
+                'stage'  : stage,
+                'count'  : total,
+                'mean'   : acc / total,
+                'p50'    : min( top, self.quantile( counts, total, 0.50 ) ),
+                'p95'    : min( top, self.quantile( counts, total, 0.95 ) ),
+                'max'    : top,
+            } )
+
+        return ret
+
+    def prometheus( self ):
+        # text exposition format
+        with self.lock:
+            items = sorted( ( key, [ list( val[0] ) ] + val[1:] ) for key, val in self.data.items() )
+
+        lines = [ '# HELP ftgram_stage_seconds Time spent per command stage.', '# TYPE ftgram_stage_seconds histogram' ]
+        for ( command, stage ), ( counts, total, acc, top ) in items:
+            label = f'command="{command}",stage="{stage}"'
+            acc_n = 0
+            for bound, num in zip( list( self.buckets ) + [ '+Inf' ], counts ):
+                acc_n += num
+                lines.append( f'ftgram_stage_seconds_bucket{{{label},le="{bound}"}} {acc_n}' )
+            lines.append( f'ftgram_stage_seconds_sum{{{label}}} {acc}' )
+            lines.append( f'ftgram_stage_seconds_count{{{label}}} {total}' )
+
+        return '\n'.join( lines ) + '\n'
+
+stage_stats = StageStats( _STATS_ENABLED )
+
+# chat ids allowed to use /stats
+admins = set()
+
+class MetricsHandler( BaseHTTPRequestHandler ):
+
+    def do_GET( self ):
+        if self.path != '/metrics':
+            self.send_error( 404 )
+            return
+        body = get_prometheus().encode()
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'text/plain; version=0.0.4' )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, format, *args ):
+        # no access log on stderr
+        pass
+
+def get_prometheus():
+
+    text = stage_stats.prometheus()
+
+    # cache and outbox counters
+    for name, elem in [ ( 'quote', quote_cache ), ( 'chart', chart_cache ), ( 'screener', screener_cache ) ]:
+        st    = elem.stats()
+        text += f'ftgram_cache_hits_total{{cache="{name}"}} {st["hits"]}\n'
+        text += f'ftgram_cache_misses_total{{cache="{name}"}} {st["misses"]}\n'
+    st    = outbox.stats()
+    text += f'ftgram_outbox_depth {st["depth"]}\n'
+    text += f'ftgram_outbox_sent_total {st["sent"]}\n'
+    text += f'ftgram_outbox_failed_total {st["failed"]}\n'
+    st    = webhook.stats()
+    text += f'ftgram_webhook_depth {st["depth"]}\n'
+    text += f'ftgram_webhook_handled_total {st["handled"]}\n'
+    text += f'ftgram_webhook_refused_total {st["refused"]}\n'
+
+    return text
+
+def start_metrics_server( _port ):
+
+    # local only, scraped by a prometheus agent on the same host
+    server = ThreadingHTTPServer( ( '127.0.0.1', _port ), MetricsHandler )
+    threading.Thread( target=server.serve_forever, name='metrics', daemon=True ).start()
+
+    return server
+
+def load_admins():
+
+    # chat ids allowed to use /stats
+    if not os.path.isfile( _ADMIN_FILE ): return set()
+    with open( _ADMIN_FILE, 'r' ) as fp:
+        return { int( line.strip() ) for line in fp if line.strip().lstrip( '-' ).isdigit() }
+
+# -------------------------------------------------------------------------------------------------
+# State
+# -------------------------------------------------------------------------------------------------
+
+class StateStore:
+    """Per-chat parameters in SQLite, loaded lazily and kept in memory."""
+
+    def __init__( self, path, defaults ):
+        self.path     = path
+        self.defaults = defaults
+        self.chats    = {}
+        self.conn     = None
+        self.lock     = threading.RLock()
+
+    def connect( self ):
+        # caller holds the lock
+        if self.conn is None:
+            self.conn = sqlite3.connect( self.path, check_same_thread=False )
+            self.conn.execute( 'PRAGMA journal_mode=WAL' )
+            self.conn.execute( 'CREATE TABLE IF NOT EXISTS chats ( chat_id INTEGER PRIMARY KEY, params TEXT NOT NULL )' )
+            self.conn.commit()
+        return self.conn
+
+    def get( self, chat_id ):
+        with self.lock:
+            if chat_id in self.chats: return self.chats[ chat_id ]
+
+            row = self.connect().execute( 'SELECT params FROM chats WHERE chat_id = ?', ( chat_id, ) ).fetchone()
+
+            # defaults fill keys added after the chat was stored
+            ret = copy.deepcopy( self.defaults )
+            if row is not None: ret.update( json.loads( row[0] ) )
+            self.chats[ chat_id ] = ret
+
+            return ret
+
+    def save( self, chat_id ):
+        with self.lock:
+            if chat_id not in self.chats: return
+            text = json.dumps( self.chats[ chat_id ] )
+
+            # one transaction per write, either fully applied or not at all
+            with self.connect() as conn:
+                conn.execute( 'INSERT OR REPLACE INTO chats ( chat_id, params ) VALUES ( ?, ? )', ( chat_id, text ) )
+
+    def close( self ):
+        with self.lock:
+            if self.conn is not None: self.conn.close()
+            self.conn = None
+
+state_store = StateStore( _STATE_FILE, params )
+
+# -------------------------------------------------------------------------------------------------
+# Bars
+# -------------------------------------------------------------------------------------------------
+
+class PriceMatrix:
+    """Bars of many symbols as one ( dates x symbols ) array per field, sharing a date index.
+
+    Arrays are column-major, so the bars of one symbol are a contiguous, zero-copy view.
+    """
+
+    fields = [ 'open', 'high', 'low', 'close', 'volume' ]
+
+    def __init__( self, index, symbols, data ):
+        self.index   = index            # DatetimeIndex
+        self.symbols = list( symbols )
+        self.cols    = { symbol: idx for idx, symbol in enumerate( self.symbols ) }
+        self.data    = data             # field -> ( dates x symbols ) array
+
+    @classmethod
+    def from_frames( cls, frames, dtype=None ):
+        # { symbol: date indexed bars } -> one shared date index
+        dtype = dtype or _HISTORY_DTYPE
+        if not frames:
+            return cls( pd.DatetimeIndex( [] ), [], { field: np.empty( ( 0, 0 ), dtype=dtype ) for field in cls.fields } )
+
+        symbols = list( frames.keys() )
+        wide    = pd.concat( frames, names=[ 'symbol', 'date' ] ).unstack( level=0 )
+        data    = { field: np.asfortranarray( wide[ field ].reindex( columns=symbols ).to_numpy( dtype=dtype ) )
+                    for field in cls.fields if field in wide.columns.get_level_values( 0 ) }
+
+        return cls( pd.DatetimeIndex( wide.index ), symbols, data )
+
+    @property
+    def dates( self ):
+        return self.index.values
+
+    def take( self, field, symbols=None ):
+        # ( dates x symbols ) array, the stored array itself when symbols match
+        if symbols is None or list( symbols ) == self.symbols: return self.data[ field ]
+        ret = np.full( ( len( self.index ), len( symbols ) ), np.nan, dtype=self.data[ field ].dtype, order='F' )
+        for idx, symbol in enumerate( symbols ):
+            if symbol in self.cols: ret[ :, idx ] = self.data[ field ][ :, self.cols[ symbol ] ]
+        return ret
+
+    def column( self, field, symbol ):
+        # view, no copy
+        return self.data[ field ][ :, self.cols[ symbol ] ]
+
+    def series( self, field, symbol ):
+        col = self.column( field, symbol )
+        return pd.Series( col, index=self.index, name=symbol, copy=False )[ ~np.isnan( col ) ]
+
+    def last( self, field, symbols ):
+        # last valid value per symbol
+        arr   = self.take( field, symbols )
+        if arr.shape[0] == 0: return np.full( arr.shape[1], np.nan )
+        valid = ~np.isnan( arr )
+        row   = arr.shape[0] - 1 - np.argmax( valid[::-1], axis=0 )
+        return np.where( valid.any( axis=0 ), arr[ row, np.arange( arr.shape[1] ) ], np.nan )
+
+    def nbytes( self ):
+        return sum( elem.nbytes for elem in self.data.values() ) + self.index.nbytes
+
+    def save( self, path ):
+        # one .npy per field, written to a temp dir then swapped in
+        tmp = path + '.tmp'
+        os.makedirs( tmp, exist_ok=True )
+        for field, arr in self.data.items():
+            np.save( os.path.join( tmp, f'{field}.npy' ), np.asfortranarray( arr ) )    # views of the store are strided
+        np.save( os.path.join( tmp, 'index.npy' ), self.index.values.astype( 'datetime64[ns]' ) )
+        with open( os.path.join( tmp, 'meta.json' ), 'w' ) as fp:
+            json.dump( { 'symbols': self.symbols, 'tz': str( self.index.tz ) if self.index.tz else None }, fp )
+        if os.path.isdir( path ):
+            os.replace( path, path + '.old' )
+            os.replace( tmp, path )
+            shutil.rmtree( path + '.old' )
+        else:
+            os.replace( tmp, path )
+
+    @classmethod
+    def load( cls, path, mmap=True ):
+        # memory-mapped arrays are paged in on access
+        with open( os.path.join( path, 'meta.json' ), 'r' ) as fp:
+            meta = json.load( fp )
+        index = pd.DatetimeIndex( np.load( os.path.join( path, 'index.npy' ) ) )
+        if meta['tz']: index = index.tz_localize( 'UTC' ).tz_convert( meta['tz'] )
+        data  = { field: np.load( os.path.join( path, f'{field}.npy' ), mmap_mode='r' if mmap else None )
+                  for field in cls.fields if os.path.isfile( os.path.join( path, f'{field}.npy' ) ) }
+        return cls( index, meta['symbols'], data )
+
+class BarStore:
+    """Resident bars of many symbols, the arrays every PriceMatrix is cut from.
+
+    One column-major ( dates x symbols ) array per field with spare rows and columns, so new
+    bars and new symbols are written in place. Rows older than the window are dropped when
+    the arrays have to be reallocated, earlier matrices keep the old arrays.
+    """
+
+    def __init__( self, fields, window, dtype=None, tz=None ):
+        self.fields = fields
+        self.window = window            # pandas timedelta string
+        self.dtype  = dtype or _HISTORY_DTYPE
+        self.tz     = tz                # stored as naive UTC, handed out in tz
+        self.clear()
+
+    def clear( self ):
+        # arrays are created on first use, numpy is imported lazily
+        self.index   = None             # used rows, sorted
+        self.symbols = []
+        self.cols    = {}
+        self.data    = {}
+
+    def init( self ):
+        if self.index is not None: return
+        self.index = np.empty( 0, dtype='datetime64[ns]' )
+        self.data  = { field: np.empty( ( 0, 0 ), dtype=self.dtype, order='F' ) for field in self.fields }
+
+    def __contains__( self, symbol ):
+        return symbol in self.cols
+
+    def to_dates( self, index ):
+        index = pd.DatetimeIndex( index )
+        if index.tz is not None: index = index.tz_convert( 'UTC' ).tz_localize( None )
+        return index.values.astype( 'datetime64[ns]' )
+
+    def to_index( self, dates ):
+        index = pd.DatetimeIndex( dates, name='date' )
+        return index if self.tz is None else index.tz_localize( 'UTC' ).tz_convert( self.tz )
+
+    def reserve( self, dates, ncol ):
+        # room for new rows and columns, in place when they only extend the tail
+        new  = np.setdiff1d( dates, self.index )
+        nrow = len( self.index )
+        rcap, ccap = self.data[ self.fields[0] ].shape
+        tail = len( new ) == 0 or nrow == 0 or new[0] > self.index[-1]
+        if tail and nrow + len( new ) <= rcap and ncol <= ccap:
+            self.index = np.concatenate( [ self.index, new ] )
+            return
+
+        # reallocate with some slack, trimmed to the window
+        index = np.union1d( self.index, new )
+        index = index[ index >= index[-1] - np.timedelta64( pd.Timedelta( self.window ).value, 'ns' ) ]
+        keep  = np.flatnonzero( self.index >= index[0] )
+        rows  = np.searchsorted( index, self.index[ keep ] )
+        rcap  = len( index ) + max( 8, len( index ) // 16 )
+        ccap  = max( ccap, ncol + max( 16, ncol // 16 ) )
+        for field, old in self.data.items():
+            arr = np.full( ( rcap, ccap ), np.nan, dtype=self.dtype, order='F' )
+            arr[ rows, :old.shape[1] ] = old[ keep ]
+            self.data[ field ] = arr
+        self.index = index
+
+    def write_many( self, frames, replace=(), before=None ):
+        """Write date indexed bars, returns the symbols whose bars dated before `before` changed."""
+        frames = { symbol: _data for symbol, _data in frames.items() if _data is not None and not _data.empty }
+        if not frames: return set()
+
+        self.init()
+        for symbol in frames:
+            if symbol not in self.cols:
+                self.cols[ symbol ] = len( self.symbols )
+                self.symbols.append( symbol )
+        dates = { symbol: self.to_dates( _data.index ) for symbol, _data in frames.items() }
+        self.reserve( np.unique( np.concatenate( list( dates.values() ) ) ), len( self.symbols ) )
+
+        changed = set()
+        before  = None if before is None else self.to_dates( [ before ] )[0]
+        for symbol, _data in frames.items():
+            col = self.cols[ symbol ]
+            if symbol in replace:
+                for arr in self.data.values(): arr[ :, col ] = np.nan
+
+            # bars older than the window were trimmed
+            rows = np.searchsorted( self.index, dates[ symbol ] )
+            ok   = rows < len( self.index )
+            ok[ ok ] = self.index[ rows[ ok ] ] == dates[ symbol ][ ok ]
+            done = ok & ( dates[ symbol ] < before ) if before is not None else None
+            for field, arr in self.data.items():
+                if field not in _data.columns: continue
+                vals = _data[ field ].to_numpy( dtype=self.dtype )
+                if done is not None and symbol not in changed and not np.array_equal( arr[ rows[ done ], col ], vals[ done ], equal_nan=True ):
+                    changed.add( symbol )
+                arr[ rows[ ok ], col ] = vals[ ok ]
+
+        return changed
+
+    def valid( self, symbol ):
+        # rows holding a bar of symbol
+        return np.flatnonzero( ~np.isnan( self.data[ 'close' ][ :len( self.index ), self.cols[ symbol ] ] ) )
+
+    def last_date( self, symbol ):
+        rows = self.valid( symbol ) if symbol in self.cols else []
+        return self.to_index( self.index[ rows[-1:] ] )[0] if len( rows ) else None
+
+    def differs( self, symbol, frame, before, fields=( 'close', 'adjclose' ), rtol=1e-4 ):
+        # stored bars before `before` that frame has with other values
+        dates = self.to_dates( frame.index )
+        rows  = np.searchsorted( self.index, dates )
+        ok    = rows < len( self.index )
+        ok[ ok ] = self.index[ rows[ ok ] ] == dates[ ok ]
+        ok   &= dates < self.to_dates( [ before ] )[0]
+        col   = self.cols[ symbol ]
+        for field in fields:
+            if field not in frame.columns or field not in self.data: continue
+            prev = self.data[ field ][ rows[ ok ], col ].astype( float )
+            new  = frame[ field ].to_numpy( dtype=float )[ ok ]
+            if not np.allclose( prev, new, rtol=rtol, equal_nan=True ): return True
+        return False
+
+    def frame( self, symbol, before=None ):
+        # bars of one symbol as a date indexed frame ( for disk )
+        rows  = self.valid( symbol )
+        if before is not None: rows = rows[ self.index[ rows ] < self.to_dates( [ before ] )[0] ]
+        col   = self.cols[ symbol ]
+        return pd.DataFrame( { field: arr[ rows, col ] for field, arr in self.data.items() }, index=self.to_index( self.index[ rows ] ) )
+
+    def matrix( self, symbols ):
+        """PriceMatrix of symbols, views of the stored arrays when symbols are all of them."""
+        self.init()
+        nrow   = len( self.index )
+        known  = [ symbol for symbol in symbols if symbol in self.cols ]
+        fields = [ field for field in PriceMatrix.fields if field in self.data ]
+        if known == self.symbols:
+            return PriceMatrix( self.to_index( self.index ), known, { field: self.data[ field ][ :nrow, :len( known ) ] for field in fields } )
+
+        # gather the columns, rows without any of their bars are left out
+        cols = [ self.cols[ symbol ] for symbol in known ]
+        rows = np.flatnonzero( ~np.isnan( self.data[ 'close' ][ :nrow, cols ] ).all( axis=1 ) )
+        data = { field: np.asfortranarray( self.data[ field ][ np.ix_( rows, cols ) ] ) for field in fields }
+        return PriceMatrix( self.to_index( self.index[ rows ] ), known, data )
+
+    def nbytes( self ):
+        return sum( elem.nbytes for elem in self.data.values() ) + ( self.index.nbytes if self.index is not None else 0 )
+
+# daily bars, loaded lazily from _HISTORY_DIR
+history_store = BarStore( [ 'open', 'high', 'low', 'close', 'adjclose', 'volume' ], f'{366 * _HISTORY_YEARS}D' )
+
+# 1m bars of the last _INTRADAY_DAYS
+intraday_store = BarStore( PriceMatrix.fields, f'{_INTRADAY_DAYS}D', tz='UTC' )
+
+# -------------------------------------------------------------------------------------------------
+# Indicators
+# -------------------------------------------------------------------------------------------------
+
+def rsi_step( _gain, _loss, _delta, _period ):
+
+    # Wilder smoothing, same operation order as TA-Lib (works on scalars and arrays)
+    _gain = ( _gain * ( _period - 1 ) + np.maximum( _delta, 0.0 ) ) / _period
+    _loss = ( _loss * ( _period - 1 ) - np.minimum( _delta, 0.0 ) ) / _period
+    return _gain, _loss
+
+def rsi_value( _gain, _loss ):
+
+    # same zero guard as TA-Lib
+    total = _gain + _loss
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return np.where( np.abs( total ) < 1e-8, 0.0, 100.0 * ( _gain / total ) )
+
+def cci_value( _window ):
+
+    # _window: ( period x columns ) typical prices, latest last
+    period = _window.shape[0]
+    avg    = _window.sum( axis=0 ) / period
+    dev    = np.abs( _window - avg ).sum( axis=0 )
+    diff   = _window[-1] - avg
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return np.where( ( diff == 0 ) | ( dev == 0 ), 0.0, diff / ( 0.015 * ( dev / period ) ) )
+
+def compact_bars( _high, _low, _close ):
+
+    # move each column's missing bars to the top, so valid bars are contiguous at the bottom
+    valid  = ~( np.isnan( _high ) | np.isnan( _low ) | np.isnan( _close ) )
+    order  = np.argsort( valid, axis=0, kind='stable' )
+    take   = lambda x: np.take_along_axis( np.where( valid, x, np.nan ), order, axis=0 )
+
+    return take( _high ), take( _low ), take( _close ), order, valid.sum( axis=0 )
+
+def seed_rsi( _close, _period ):
+
+    # TA-Lib RSI over each column of bottom-aligned closes, returns final ( gain, loss, diffs )
+    ncol = _close.shape[1]
+    gain = np.zeros( ncol )
+    loss = np.zeros( ncol )
+    num  = np.zeros( ncol, dtype=int )
+
+    for t in range( 1, _close.shape[0] ):
+        delta = _close[t] - _close[t-1]
+        ok    = ~np.isnan( delta )
+        delta = np.where( ok, delta, 0.0 )
+        num  += ok
+
+        # first _period deltas are summed, then averaged
+        seeding = ok & ( num <= _period )
+        gain    = np.where( seeding, gain + np.maximum( delta, 0.0 ), gain )
+        loss    = np.where( seeding, loss - np.minimum( delta, 0.0 ), loss )
+        seeded  = ok & ( num == _period )
+        gain    = np.where( seeded, gain / _period, gain )
+        loss    = np.where( seeded, loss / _period, loss )
+
+        # Wilder smoothing afterwards
+        smooth     = ok & ( num > _period )
+        sgain, sloss = rsi_step( gain, loss, delta, _period )
+        gain    = np.where( smooth, sgain, gain )
+        loss    = np.where( smooth, sloss, loss )
+
+    return gain, loss, num
+
+class IndicatorEngine:
+    """Keeps Wilder RSI and CCI state per key so new bars are applied in O(1).
+
+    State covers completed bars only; the last bar of each column (today's, still
+    changing) is applied on top of it without being committed. Cold keys are
+    seeded together in one vectorized pass.
+    """
+
+    def __init__( self, rsi_period=_RSI_PERIOD, cci_period=_CCI_PERIOD ):
+        self.rsi_period = rsi_period
+        self.cci_period = cci_period
+        self.states     = {}
+        self.lock       = threading.Lock()
+
+    def seed( self, _keys, _cols, _dates, _tp, _close, _count ):
+        # full computation over completed bars ( all rows but the last )
+        gain, loss, num = seed_rsi( _close[:-1, _cols], self.rsi_period )
+        width = self.cci_period - 1
+
+        for idx, col in enumerate( _cols ):
+            if num[idx] < self.rsi_period or _count[col] - 1 < width:
+                self.states.pop( _keys[col], None )
+                continue
+            self.states[ _keys[col] ] = {
+                'date' : _dates[-2, col],
+                'close': _close[-2, col],
+                'gain' : gain[idx],
+                'loss' : loss[idx],
+                'tp'   : deque( _tp[-1-width:-1, col], maxlen=width ),
+            }
+
+    def advance( self, _state, _dates, _tp, _close ):
+        # commit completed bars newer than the state, _dates/_tp/_close are one column
+        start = np.searchsorted( _dates[:-1], _state['date'], side='right' )
+        for row in range( start, len( _dates ) - 1 ):
+            _state['gain'], _state['loss'] = rsi_step( _state['gain'], _state['loss'], _close[row] - _state['close'], self.rsi_period )
+            _state['close'] = _close[row]
+            _state['date' ] = _dates[row]
+            _state['tp'   ].append( _tp[row] )
+
+    def update_many( self, _keys, _dates, _high, _low, _close ):
+        """Return ( rsi, cci ) arrays for the last bar of each ( dates x keys ) column."""
+        high, low, close, order, count = compact_bars( _high, _low, _close )
+        dates = np.asarray( _dates )[ order ]
+        tp    = ( high + low + close ) / 3
+        rsi   = np.full( len( _keys ), np.nan )
+        cci   = np.full( len( _keys ), np.nan )
+
+        with self.lock:
+
+            # warm keys only need the bars after their committed one
+            cold = []
+            for col, key in enumerate( _keys ):
+                if count[col] < 2:
+                    self.states.pop( key, None )
+                    continue
+                state = self.states.get( key )
+                done  = dates[ -count[col]:-1, col ]
+                pos   = np.searchsorted( done, state['date'] ) if state is not None else len( done )
+
+                # re-seed when the committed bar is gone or was re-adjusted ( split, dividend )
+                if pos == len( done ) or done[pos] != state['date'] or close[ pos - count[col], col ] != state['close']:
+                    cold.append( col )
+                else:
+                    self.advance( state, dates[ -count[col]:, col ], tp[ -count[col]:, col ], close[ -count[col]:, col ] )
+
+            if cold: self.seed( _keys, cold, dates, tp, close, count )
+
+            # apply the latest bar without committing it
+            cols = [ col for col, key in enumerate( _keys ) if key in self.states and count[col] >= 2 ]
+            if cols:
+                states = [ self.states[ _keys[col] ] for col in cols ]
+                gain   = np.array( [ state['gain' ] for state in states ] )
+                loss   = np.array( [ state['loss' ] for state in states ] )
+                prev   = np.array( [ state['close'] for state in states ] )
+                window = np.array( [ list( state['tp'] ) for state in states ] ).T
+
+                gain, loss = rsi_step( gain, loss, close[-1, cols] - prev, self.rsi_period )
+                rsi[ cols ] = rsi_value( gain, loss )
+                cci[ cols ] = cci_value( np.vstack( [ window, tp[-1, cols] ] ) )
+
+            # histories too short for a state are computed in full, TA-Lib starts at period + 1 bars
+            short = [ col for col, key in enumerate( _keys ) if key not in self.states and count[col] >= 2 ]
+            if short:
+                gain, loss, num = seed_rsi( close[:, short], self.rsi_period )
+                rsi[ short ] = np.where( num >= self.rsi_period, rsi_value( gain, loss ), np.nan )
+                cols = [ col for col in short if count[col] >= self.cci_period ]
+                if cols: cci[ cols ] = cci_value( tp[ -self.cci_period:, cols ] )
+
+        return rsi, cci
+
+    def update( self, _key, _bars ):
+        """Return ( rsi, cci ) for the last bar of _bars (date index, high/low/close columns)."""
+        rsi, cci = self.update_many( [ _key ], _bars.index.values,
+                                     _bars[ [ 'high'  ] ].to_numpy( dtype=float ),
+                                     _bars[ [ 'low'   ] ].to_numpy( dtype=float ),
+                                     _bars[ [ 'close' ] ].to_numpy( dtype=float ) )
+        return rsi[0], cci[0]
+
+    def reset( self, _key=None ):
+        with self.lock:
+            if _key is None: self.states.clear()
+            else:            self.states.pop( _key, None )
+
+indicator_engine = IndicatorEngine()
+
+# -------------------------------------------------------------------------------------------------
+# Screener
+# -------------------------------------------------------------------------------------------------
+
+class Screener:
+    """RSI, CCI and daily change over a symbol universe, with a sorted index per metric."""
+
+    metrics = [ 'rsi', 'cci', 'day' ]
+
+    def __init__( self ):
+        self.engine  = IndicatorEngine()
+        self.symbols = []           # arrays once built
+        self.values  = { name: [] for name in self.metrics }
+        self.index   = { name: ( [], [] ) for name in self.metrics }
+        self.updated = None
+        self.lock    = threading.Lock()
+
+    def build( self, _symbols, _dates, _high, _low, _close ):
+        # same indicator logic as get_metric
+        rsi, cci = self.engine.update_many( _symbols, _dates, _high, _low, _close )
+
+        # daily change from the last two valid closes
+        close = compact_bars( _high, _low, _close )[2]
+        with np.errstate( divide='ignore', invalid='ignore' ):
+            day = close[-1] / close[-2] - 1 if close.shape[0] > 1 else np.full( len( _symbols ), np.nan )
+
+        # ( sorted values, positions ), missing values left out
+        values = { 'rsi': rsi, 'cci': cci, 'day': day }
+        index  = {}
+        for name, val in values.items():
+            order = np.argsort( val, kind='stable' )
+            order = order[ ~np.isnan( val[ order ] ) ]
+            index[ name ] = ( val[ order ], order )
+
+        with self.lock:
+            self.symbols = np.array( _symbols, dtype=object )
+            self.values  = values
+            self.index   = index
+            self.updated = datetime.now()
+
+    def load( self, _symbols ):
+        # history store only downloads bars missing since the last load
+        history = get_history( Ticker( _symbols, verify=False, asynchronous=True ) )
+
+        self.build_matrix( history )
+
+        # snapshot for the next start
+        history.save( _UNIVERSE_SNAP )
+
+    def build_matrix( self, _mat ):
+        take = lambda field: _mat.take( field ).astype( float, copy=False )
+        self.build( _mat.symbols, _mat.dates, take( 'high' ), take( 'low' ), take( 'close' ) )
+
+    def query( self, _conds ):
+        """Return [ ( symbol, { metric: value } ) ] matching all ( metric, op, value ) conditions."""
+        with self.lock:
+            symbols, values, index = self.symbols, self.values, self.index
+
+        # each condition is a slice of the sorted index
+        sel = None
+        for name, op, val in _conds:
+            vals, order = index[ name ]
+            if   op == '<' : hit = order[ :np.searchsorted( vals, val, side='left'  ) ]
+            elif op == '<=': hit = order[ :np.searchsorted( vals, val, side='right' ) ]
+            elif op == '>' : hit = order[  np.searchsorted( vals, val, side='right' ): ]
+            else:            hit = order[  np.searchsorted( vals, val, side='left'  ): ]
+            sel = hit if sel is None else np.intersect1d( sel, hit )
+
+        if sel is None or len( sel ) == 0: return []
+
+        # most extreme first for the first condition
+        name, op, _ = _conds[0]
+        sel = sel[ np.argsort( values[ name ][ sel ], kind='stable' ) ]
+        if op in ( '>', '>=' ): sel = sel[::-1]
+
+        return [ ( symbols[ pos ], { key: values[ key ][ pos ] for key in self.metrics } ) for pos in sel ]
+
+    def ready( self ):
+        with self.lock:
+            return self.updated is not None
+
+def load_universe():
+
+    # one symbol per line, '#' starts a comment
+    if not os.path.isfile( _UNIVERSE_FILE ): return []
+    with open( _UNIVERSE_FILE, 'r' ) as fp:
+        lines = [ line.split( '#' )[0].strip().upper() for line in fp ]
+
+    return list( dict.fromkeys( elem for elem in lines if elem ) )
+
+def parse_screen( _args ):
+
+    # rsi<30 cci<-100 day>2 [count], day is in percent
+    conds = []
+    num   = _SCREENER_ROWS
+    for elem in _args:
+        found = re.match( r'^(rsi|cci|day)(<=|>=|<|>)(-?\d+(?:\.\d+)?)$', elem.lower() )
+        if found:
+            val = float( found.group(3) )
+            if found.group(1) == 'day': val /= 100
+            conds.append( ( found.group(1), found.group(2), val ) )
+        else:
+            num = int( elem )
+
+    return conds, max( 1, min( num, _SCREENER_MAX ) )
+
+def get_screen( _result ):
+
+    desc = [ f'<code>[{symbol:5}] RSI {val["rsi"]:5.1f} CCI {val["cci"]:6.1f} DAY {val["day"]*100:+5.1f}%</code>' for symbol, val in _result ]
+
+    return desc
+
+screener = Screener()
 
 # -------------------------------------------------------------------------------------------------
 # Functions
@@ -109,95 +1220,441 @@ def escape_markdown( text ):
     reparse = re.sub(r"\\\\([_*\[\]()~`>\#\+\-=|\.!])", r"\1", parse)
     return reparse
 
-def save_params( _params ):
+def save_params( _chat_id ):
 
-    # save to file
-    with open( _PARAM_FILE, 'w' ) as fp:
-        json.dump( _params, fp, indent=4 )
+    # save to state store
+    state_store.save( _chat_id )
 
     return
 
 def load_params():
 
-    # load from file
+    # load from legacy file
     with open( _PARAM_FILE, 'r' ) as fp:
         ret = json.load( fp )
 
     return ret
 
-def get_source( _port ):
+def get_history_path( _symbol ):
+
+    return os.path.join( _HISTORY_DIR, f'{_symbol}.pkl' )
+
+def load_history( _symbols ):
+
+    # symbols not in memory yet are read from disk into the store, a chunk of frames at a time
+    frames = {}
+    for symbol in _symbols:
+        path = get_history_path( symbol )
+        if symbol in history_store or not os.path.isfile( path ): continue
+        try:
+            frames[ symbol ] = pd.read_pickle( path )
+        except Exception:
+            continue
+        if len( frames ) == _FETCH_CHUNK:
+            history_store.write_many( frames )
+            frames = {}
+    history_store.write_many( frames )
+
+    return
+
+def market_today():
+
+    # date of the current ( possibly unfinished ) daily bar
+    return pd.Timestamp( datetime.now( _MARKET_TZ ).date() )
+
+def save_history( _symbol ):
+
+    # only completed bars go to disk, today's bar keeps changing until the close
+    done = history_store.frame( _symbol, market_today() )
+    if done.empty: return
+
+    # write to temp file then rename, so readers never see partial files
+    os.makedirs( _HISTORY_DIR, exist_ok=True )
+    path = get_history_path( _symbol )
+    tmp  = f'{path}.{os.getpid()}.tmp'    # shard processes may write the same symbol
+    done.to_pickle( tmp )
+    os.replace( tmp, path )
+
+    return
+
+def normalize_bars( _data ):
+
+    # yahooquery mixes date and tz-aware datetime (for today's bar), use naive dates
+    dates = [ elem.date() if isinstance( elem, datetime ) else elem for elem in _data.index ]
+    _data = _data.copy()
+    _data.index = pd.to_datetime( dates )
+    _data.index.name = 'date'
+
+    return _data
+
+def normalize_intraday( _data ):
+
+    # intraday bars come in each exchange's timezone, mixed watchlists need one
+    _data = _data.copy()
+    _data.index = pd.to_datetime( _data.index, utc=True )
+    _data.index.name = 'date'
+
+    return _data
+
+def split_history( _history, _daily=True ):
+
+    # yahooquery returns a (symbol, date) frame, or a dict when some symbols fail
+    ret  = {}
+    norm = normalize_bars if _daily else normalize_intraday
+    if isinstance( _history, pd.DataFrame ):
+        if _history.empty: return ret
+        for symbol, _data in _history.groupby( level=0 ):
+            ret[ symbol ] = norm( _data.droplevel( 0 ) )
+    elif isinstance( _history, dict ):
+        for symbol, _data in _history.items():
+            if isinstance( _data, pd.DataFrame ) and not _data.empty:
+                if isinstance( _data.index, pd.MultiIndex ): _data = _data.droplevel( 0 )
+                ret[ symbol ] = norm( _data )
+
+    return ret
+
+def is_transient( _error ):
+
+    # network errors, timeouts, rate limits and server errors hit every symbol alike
+    response = getattr( _error, 'response', None )
+    if response is not None and response.status_code is not None:
+        return response.status_code == 429 or response.status_code >= 500
+
+    return isinstance( _error, OSError )
+
+def fetch_chunk( _chunk, _fetch, _retries, _splits=_FETCH_SPLITS ):
+
+    # retry with exponential backoff and jitter
+    for attempt in range( _retries ):
+        try:
+            return _fetch( _chunk ), {}
+        except Exception as e:
+            error = e
+            if attempt < _retries - 1:
+                time.sleep( _FETCH_BACKOFF * ( 2 ** attempt ) * random.uniform( 0.5, 1.5 ) )
+
+    # splitting only adds load during an outage, fail the whole chunk
+    if is_transient( error ) or len( _chunk ) == 1 or _splits == 0:
+        return {}, { symbol: str( error ) for symbol in _chunk }
+
+    # still failing, split to isolate bad symbols
+    half = len( _chunk ) // 2
+    ret1, err1 = fetch_chunk( _chunk[:half], _fetch, 1, _splits - 1 )
+    ret2, err2 = fetch_chunk( _chunk[half:], _fetch, 1, _splits - 1 )
+
+    return { **ret1, **ret2 }, { **err1, **err2 }
+
+def fetch_chunked( _symbols, _fetch, _chunk=_FETCH_CHUNK ):
+    """Run _fetch( symbols ) -> dict over chunks concurrently, returns ( results, { symbol: error } )."""
+    chunks  = [ _symbols[ idx:idx+_chunk ] for idx in range( 0, len( _symbols ), _chunk ) ]
+    futures = [ fetch_executor.submit( fetch_chunk, elem, _fetch, _FETCH_RETRIES ) for elem in chunks ]
+
+    result = {}
+    errors = {}
+    for elem in futures:
+        ret, err = elem.result()
+        result.update( ret )
+        errors.update( err )
+
+    return result, errors
+
+def get_history( _tick, _fetch=True ):
+
+    # network requests run without the lock, only store access is serialized
+    with history_lock:
+        load_history( _tick.symbols )
+        last = { symbol: history_store.last_date( symbol ) for symbol in _tick.symbols }
+    known   = [ symbol for symbol in _tick.symbols if last[ symbol ] is not None ]
+    unknown = [ symbol for symbol in _tick.symbols if last[ symbol ] is None ]
+
+    fetched = {}
+
+    # only fetch the missing tail for stored symbols, unless it was fetched just now
+    now = time.monotonic()
+    due = [ symbol for symbol in known if now - history_fetched.get( symbol, float( '-inf' ) ) >= _HISTORY_TTL ]
+    # one request per last stored date, so a halted symbol does not stretch everyone's tail
+    starts = {}
+    for symbol in due if _fetch else []:
+        starts.setdefault( last[ symbol ].strftime( '%Y-%m-%d' ), [] ).append( symbol )
+    for start, symbols in starts.items():
+        fetch = lambda chunk, start=start: split_history( Ticker( chunk, verify=False, asynchronous=True ).history( start=start, interval='1d' ) )
+        fetched.update( fetch_chunked( symbols, fetch )[0] )
+
+    # the tail overlaps the stored bars, changed closes mean a split or dividend re-adjusted them
+    # only bars that were complete when stored count, history_open is the one stored mid-session
+    today = market_today()
+    with history_lock:
+        adjusted = [ symbol for symbol in known if symbol in fetched and
+                     history_store.differs( symbol, fetched[ symbol ], min( history_open.get( symbol ) or today, today ) ) ]
+    for symbol in adjusted: del fetched[ symbol ]
+
+    # full window for new and re-adjusted symbols
+    if ( unknown or adjusted ) and _fetch:
+        fetch = lambda chunk: split_history( Ticker( chunk, verify=False, asynchronous=True ).history( period=f'{_HISTORY_YEARS}y', interval='1d' ) )
+        fetched.update( fetch_chunked( unknown + adjusted, fetch )[0] )
+
+    # write in place and persist changed completed bars, symbols that failed keep their stored bars
+    with history_lock:
+        changed = history_store.write_many( fetched, replace=adjusted, before=today )
+        for symbol, _data in fetched.items():
+            history_open   [ symbol ] = _data.index[-1] if _data.index[-1] >= today else None
+            history_fetched[ symbol ] = now
+        for symbol in changed: save_history( symbol )
+
+        return history_store.matrix( _tick.symbols )
+
+def resample_bars( _mat, _rule ):
+
+    # coarser bars from 1m bars, all symbols at once
+    how = { 'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum' }
+
+    # bins start at the regular session open, not at midnight
+    offset = pd.Timedelta( f'{_SESSIONS["regular"][0]}:00' ) % pd.Timedelta( _rule )
+
+    data = {}
+    for field, arr in _mat.data.items():
+        wide = pd.DataFrame( arr, index=_mat.index, copy=False ).resample( _rule, offset=offset ).agg( how[ field ] )
+        data[ field ] = wide.to_numpy( dtype=arr.dtype, copy=True )
+
+    # bins without a close have no bar, rows without any bar are dropped
+    empty = np.isnan( data[ 'close' ] )
+    for arr in data.values(): arr[ empty ] = np.nan
+    rows  = np.flatnonzero( ~empty.all( axis=1 ) )
+
+    return PriceMatrix( wide.index[ rows ], _mat.symbols, { field: np.asfortranarray( arr[ rows ] ) for field, arr in data.items() } )
+
+def is_fresh( _last, _hours=20 ):
+
+    if _last is None: return False
+
+    return pd.Timestamp.now( tz=_last.tz ) - _last < pd.Timedelta( hours=_hours )
+
+def get_intraday( _tick, _interval ):
+
+    # 1m bars are fetched once and resampled locally
+    with intraday_lock:
+        last = { symbol: intraday_store.last_date( symbol ) for symbol in _tick.symbols }
+
+    # skip symbols fetched just now, a day is enough when the buffer is fresh, otherwise refill
+    now    = time.monotonic()
+    due    = [ symbol for symbol in _tick.symbols if now - intraday_fetched.get( symbol, float( '-inf' ) ) >= _INTRADAY_TTL ]
+    recent = [ symbol for symbol in due if is_fresh( last[ symbol ] ) ]
+    stale  = [ symbol for symbol in due if symbol not in recent ]
+
+    fetched = {}
+    for symbols, period in [ ( recent, '1d' ), ( stale, '5d' ) ]:
+        if not symbols: continue
+        fetch = lambda chunk: split_history( Ticker( chunk, verify=False, asynchronous=True ).history( period=period, interval='1m' ), _daily=False )
+        fetched.update( fetch_chunked( symbols, fetch )[0] )
+
+    # written in place, bars older than _INTRADAY_DAYS go when the arrays grow
+    with intraday_lock:
+        intraday_store.write_many( fetched )
+        for symbol in fetched: intraday_fetched[ symbol ] = now
+        history = intraday_store.matrix( _tick.symbols )
+
+    return history if _INTERVALS[ _interval ] is None else resample_bars( history, _INTERVALS[ _interval ] )
+
+def fetch_quotes( _symbols ):
+
+    # unknown symbols come back as error strings
+    result, errors = fetch_chunked( _symbols, lambda chunk: Ticker( chunk, verify=False, asynchronous=True ).price )
+    result.update( errors )
+    if shared_quotes is not None: shared_quotes.put_many( result )
+
+    return result
+
+def get_quotes( _symbols ):
+
+    # pushed quotes first, then cached or polled ones
+    symbols = [ symbol.upper() for symbol in _symbols ]
+    live    = live_quotes.get_many( symbols )
+    rest    = [ symbol for symbol in symbols if symbol not in live ]
+    if shared_quotes is not None and rest:
+        live.update( shared_quotes.get_many( rest ) )
+        rest = [ symbol for symbol in rest if symbol not in live ]
+    ret     = quote_cache.get_many( rest, fetch_quotes ) if rest else {}
+    ret.update( live )
+
+    return ret
+
+def load_bars( _tick, _interval, _fetch=True ):
+
+    # stored bars, tails are only fetched when older than _HISTORY_TTL / _INTRADAY_TTL
+    return get_history( _tick, _fetch ) if _interval == '1d' else get_intraday( _tick, _interval )
+
+def get_bars( _port, _interval='1d' ):
+
+    # bars without quotes, for charts
+    tick = Ticker( _port, verify=False, asynchronous=True )
+
+    return { 'ticker': tick, 'interval': _interval, 'history': load_bars( tick, _interval ) }
+
+def get_source( _port, _interval='1d', _fetch=True ):
 
     tick = Ticker( _port, verify=False, asynchronous=True )
 
+    # quotes and history in parallel
+    price = io_executor.submit( get_quotes, tick.symbols )
+
     info = {}
     info[ 'ticker'  ] = tick
-    info[ 'price'   ] = tick.price
-    info[ 'history' ] = tick.history( period='1y', interval='1d' )
+    info[ 'interval'] = _interval
+    info[ 'history' ] = load_bars( tick, _interval, _fetch )
+    info[ 'price'   ] = price.result()
+    info[ 'errors'  ] = { key: val for key, val in info['price'].items() if not isinstance( val, dict ) }
 
     return info
 
+def get_failed( _info ):
+
+    # one line for symbols without a quote
+    if not _info['errors']: return []
+
+    return [ f'<code>Failed: {" ".join( _info["errors"].keys() )}</code>' ]
+
+def stream_source( _port, _interval='1d', _chunk=_STREAM_CHUNK ):
+
+    # yield ( metric, errors ) chunk by chunk, as they complete
+    command = stage_stats.current()
+    chunks  = [ _port[ idx:idx+_chunk ] for idx in range( 0, len( _port ), _chunk ) ]
+    futures = [ stream_executor.submit( source_metric, elem, _interval, True, command ) for elem in chunks ]
+    for elem in as_completed( futures ):
+        yield elem.result()
+
+def quote_day( _quote ):
+
+    # trading day of a quote, regularMarketTime is exchange time text or epoch seconds
+    when = _quote.get( 'regularMarketTime' )
+    try:
+        if isinstance( when, ( int, float ) ): return np.datetime64( datetime.fromtimestamp( when, _MARKET_TZ ).date() )
+        return np.datetime64( str( when )[:10], 'D' ) if when else np.datetime64( 'NaT' )
+    except ValueError:
+        return np.datetime64( 'NaT' )
+
+def apply_quotes( _dates, _quotes, _high, _low, _close ):
+
+    # quote price as the close of each column's last bar when it is for that bar's day
+    if _close.size == 0: return _high, _low, _close
+    price = np.array( [ elem.get( 'regularMarketPrice', np.nan ) for elem in _quotes ], dtype=float )
+    day   = np.array( [ quote_day( elem ) for elem in _quotes ], dtype='datetime64[D]' )
+    valid = ~np.isnan( _close )
+    last  = _close.shape[0] - 1 - np.argmax( valid[::-1], axis=0 )
+    hit   = valid.any( axis=0 ) & ~np.isnan( price ) & ( np.asarray( _dates )[ last ].astype( 'datetime64[D]' ) == day )
+    if not hit.any(): return _high, _low, _close
+
+    # the matrix arrays may be shared, change copies
+    rows, cols, price = last[ hit ], np.flatnonzero( hit ), price[ hit ]
+    _high, _low, _close = _high.copy(), _low.copy(), _close.copy()
+    _close[ rows, cols ] = price
+    _high [ rows, cols ] = np.fmax( _high[ rows, cols ], price )
+    _low  [ rows, cols ] = np.fmin( _low [ rows, cols ], price )
+
+    return _high, _low, _close
+
 def get_metric( _info ):
 
+    # only symbols with a valid quote, in requested order
+    symbols = [ key for key in _info['ticker'].symbols if isinstance( _info['price'].get( key ), dict ) ]
+
     # from Ticker.price
-    df = pd.DataFrame( _info['price'] )
-    rm_index = [ x for x in df.index if x not in attr_list ]
-    df.drop( rm_index, inplace=True )
-
-    # compute RSI & CCI
-    rsi_list = {}
-    cci_list = {}
-    for key in df.columns:
-        
-        # compute RSI
-        rsi = ta.RSI( _info['history']['close'][ key ] )[-1]   
-        rsi_list[ key ] = rsi
-        
-        # compute CCI
-        cci = ta.CCI( _info['history']['high'][ key ], _info['history']['low'][ key ], _info['history']['close'][ key ] )[-1] 
-        cci_list[ key ] = cci
-
-    # add rows
-    df.loc[ 'RSI' ] = rsi_list
-    df.loc[ 'CCI' ] = cci_list
-
-    # column reordering
-    df = df[ _info['ticker'].symbols ]
+    fields = list( attr_list.keys() )
+    values = np.array( [ [ _info['price'][key].get( field, np.nan ) for key in symbols ] for field in fields ], dtype=float ).reshape( len( fields ), len( symbols ) )
+
+    # compute RSI & CCI for all symbols at once, intraday state is kept apart from daily
+    interval = _info.get( 'interval', '1d' )
+    keys     = symbols if interval == '1d' else [ f'{key}:{interval}' for key in symbols ]
+    mat      = _info['history']
+    take     = lambda field: mat.take( field, symbols ).astype( float, copy=False )
+    high, low, close = take( 'high' ), take( 'low' ), take( 'close' )
+
+    # polled or pushed price moves today's bar between history fetches
+    if interval == '1d': high, low, close = apply_quotes( mat.dates, [ _info['price'][key] for key in symbols ], high, low, close )
+    rsi, cci = indicator_engine.update_many( keys, mat.dates, high, low, close )
+
+    # rows are measures, columns are tickers
+    df = pd.DataFrame( np.vstack( [ values, rsi, cci ] ), index=fields + [ 'RSI', 'CCI' ], columns=symbols )
 
     return df
 
-def apply_filter( _metric ):
+def compile_filter( _filter ):
 
-    desc = []
+    # turn filter table into arrays, thresholds are resolved at evaluation time
+    rules = list( _filter.values() )
+    return {
+        'key'    : list( _filter.keys() ),
+        'measure': [ rule[0] for rule in rules ],
+        'thres'  : [ rule[1] for rule in rules ],
+        'mul'    : np.array( [ rule[2] for rule in rules ], dtype=float ),
+        'pct'    : np.array( [ rule[3] for rule in rules ], dtype=float ),
+        'symbols': [ set( rule[4] ) if len( rule ) > 4 else None for rule in rules ],
+        'name'   : [ attr_list[ rule[0] ] if rule[0] in attr_list else rule[0] for rule in rules ],
+    }
 
-    # for each ticker
-    for option in _metric.columns:
+def add_filter( _name, _measure, _thres, _mul, _pct=1, _symbols=None ):
 
-        # for each filter
-        for elem in filter_dict.keys():
-
-            # get filter method
-            col = filter_dict[elem][0]              # measure
-            thr = params[ filter_dict[elem][1] ]    # threshold
-            mul = filter_dict[elem][2]              # positive or negative
-            pct = filter_dict[elem][3]              # percentage conversion
-
-            # check
-            if _metric[option][col]*mul > thr*mul:
-                name  = attr_list[col] if col in attr_list else col
-                value = _metric[option][col]*pct
-                thres = thr*pct
-                if mul < 0:
-                    desc.append( f'<code>[{option:5}]&#8595; {name}({value:.1f})&lt;{thres:.1f}</code>')
-                else:
-                    desc.append( f'<code>[{option:5}]&#8593; {name}({value:.1f})&gt;{thres:.1f}</code>')
+    global filter_rules
 
-    return desc
+    rule = [ _measure, _thres, _mul, _pct ]
+    if _symbols is not None: rule.append( [ elem.upper() for elem in _symbols ] )
+    filter_dict[ _name ] = rule
+    filter_rules = compile_filter( filter_dict )
+
+    return
+
+# compiled on first use
+filter_rules = None
 
-def check_diff( _prev, _new ):
+def get_rules():
 
-    _temp = [ elem[:elem.index('(')] for elem in _new ]
-    if _prev == _temp: return False
-    return True
+    global filter_rules
+
+    if filter_rules is None: filter_rules = compile_filter( filter_dict )
+    return filter_rules
+
+def get_thresholds( _rules, _params ):
+
+    # thresholds: parameter name or literal value, unknown parameters never match
+    return np.array( [ _params.get( elem, np.nan ) if isinstance( elem, str ) else elem for elem in _rules['thres'] ], dtype=float )
+
+def format_hit( _option, _rules, _idx, _val, _thr ):
+
+    name  = _rules['name'][ _idx ]
+    val   = _val * _rules['pct'][ _idx ]
+    thres = _thr * _rules['pct'][ _idx ]
+    if _rules['mul'][ _idx ] < 0:
+        return f'<code>[{_option:5}]&#8595; {name}({val:.1f})&lt;{thres:.1f}</code>'
+    return f'<code>[{_option:5}]&#8593; {name}({val:.1f})&gt;{thres:.1f}</code>'
+
+def format_exit( _option, _rules, _idx, _val, _thr ):
+
+    name  = _rules['name'][ _idx ]
+    val   = _val * _rules['pct'][ _idx ]
+    thres = _thr * _rules['pct'][ _idx ]
+    if _rules['mul'][ _idx ] < 0:
+        return f'<code>[{_option:5}]&#8212; {name}({val:.1f}) back above {thres:.1f}</code>'
+    return f'<code>[{_option:5}]&#8212; {name}({val:.1f}) back below {thres:.1f}</code>'
+
+def apply_filter( _metric, _params=None ):
+
+    if _params is None: _params = params
+    rules = get_rules()
+    thr   = get_thresholds( rules, _params )
+
+    # ( rules x tickers ) measures, missing measures never match
+    value = _metric.reindex( rules['measure'] ).to_numpy( dtype=float )
+    mask  = value * rules['mul'][:, None] > ( thr * rules['mul'] )[:, None]
+
+    # rules limited to some tickers
+    for idx, symbols in enumerate( rules['symbols'] ):
+        if symbols is not None: mask[ idx ] &= _metric.columns.isin( symbols )
+
+    # format hits only, ticker by ticker
+    desc = []
+    for col, idx in zip( *np.nonzero( mask.T ) ):
+        desc.append( format_hit( _metric.columns[ col ], rules, idx, value[ idx, col ], thr[ idx ] ) )
+
+    return desc
 
 def get_price( _metric ):
 
@@ -220,7 +1677,7 @@ def get_pre( _metric ):
 
     # for each ticker
     for option in _metric.columns:
-        if isnan( _metric[option]['preMarketPrice'] ) == False:
+        if np.isnan( _metric[option]['preMarketPrice'] ) == False:
             price = _metric[option]['preMarketPrice']
             delta = _metric[option]['preMarketChangePercent']*100
         else:
@@ -239,7 +1696,7 @@ def get_post( _metric ):
 
     # for each ticker
     for option in _metric.columns:
-        if isnan( _metric[option]['postMarketPrice'] ) == False:
+        if np.isnan( _metric[option]['postMarketPrice'] ) == False:
             price = _metric[option]['postMarketPrice']
             delta = _metric[option]['postMarketChangePercent']*100       
         else:
@@ -298,11 +1755,18 @@ def get_rsi( _metric ):
 
     return desc
 
+def fetch_modules( _tick, _modules, _ticker ):
+
+    # each module is a separate request, fetch them concurrently
+    futures = [ io_executor.submit( getattr, _tick, elem ) for elem in _modules ]
+
+    return [ elem.result()[_ticker] for elem in futures ]
+
 def get_info( _ticker ):
 
     # get information
     t = Ticker( _ticker, verify=False )
-    p = t.price[_ticker]
+    p = get_quotes( [ _ticker ] )[ _ticker.upper() ]
 
     # quote type
     quoteType = p['quoteType']
@@ -317,8 +1781,7 @@ def get_info( _ticker ):
 
     # additional information
     if quoteType == 'EQUITY':
-        sd = t.summary_detail [_ticker]
-        sp = t.summary_profile[_ticker]
+        sd, sp = fetch_modules( t, [ 'summary_detail', 'summary_profile' ], _ticker )
         if 'sector' in sp: 
             desc.append( f'<code>Sector   : {sp["sector"]}</code>' )
         if 'industry' in sp: 
@@ -332,9 +1795,7 @@ def get_info( _ticker ):
         if 'dividendYield' in sd:
             desc.append( f'<code>Dividend : {sd["dividendYield"]*100:.2f}%</code>' )
     elif quoteType == 'ETF':
-        sd = t.summary_detail   [_ticker]
-        f  = t.fund_holding_info[_ticker]
-        pr = t.fund_profile     [_ticker]
+        sd, f, pr = fetch_modules( t, [ 'summary_detail', 'fund_holding_info', 'fund_profile' ], _ticker )
         if 'categoryName' in pr:
             desc.append( f'<code>Category : {pr["categoryName"]}</code>' )
         if 'equityHoldings' in f and 'priceToEarnings' in f['equityHoldings']:
@@ -354,6 +1815,26 @@ def get_info( _ticker ):
 
     return desc
 
+def split_text( _text, _limit=_MESSAGE_LIMIT ):
+
+    # split at line boundaries so formatted lines stay intact
+    parts = []
+    cur   = ''
+    for line in _text.split( '\n' ):
+        while len( line ) > _limit:
+            if cur: parts.append( cur )
+            parts.append( line[:_limit] )
+            cur  = ''
+            line = line[_limit:]
+        if cur and len( cur ) + 1 + len( line ) > _limit:
+            parts.append( cur )
+            cur = line
+        else:
+            cur = cur + '\n' + line if cur else line
+    if cur: parts.append( cur )
+
+    return parts
+
 def get_num_points( index, dmonth ):
 
     last = index[-1]
@@ -365,20 +1846,22 @@ def get_num_points( index, dmonth ):
 def get_chart( _info, dmonth ):
 
     # data source
-    source = _info['history']['close']
+    source = _info['history']
 
     # for all tickers
     sr_list = []
     for option in _info['ticker'].symbols:
+        # view on stored closes
+        _data = source.series( 'close', option )
+
         # compute number of points
-        num_points = get_num_points( source[option].index, dmonth )
+        num_points = get_num_points( _data.index, dmonth )
 
         # prepare data
-        _data = source[option].rename(option)[-num_points:]
-        _data = _data[ ~_data.index.duplicated() ]  # remove duplicated index before concat
+        _data = _data[-num_points:]
 
         # normalize
-        _data = ( ( _data / _data[0] ) - 1 ) * 100.
+        _data = ( ( _data / _data.iloc[0] ) - 1 ) * 100.
 
         # add to list
         sr_list.append( _data )
@@ -386,51 +1869,966 @@ def get_chart( _info, dmonth ):
     df = pd.DataFrame( pd.concat( sr_list, axis=1 ) ).dropna()
     df.index = pd.to_datetime( df.index )
 
-    # use matplotlib
-    ax = df.plot( y=_info['ticker'].symbols )
+    # shards are separate processes already
+    if shard_id is not None: return render_chart( df, _info['ticker'].symbols )
 
-    # customization
-    mat.pyplot.xlabel( 'Date'       )
-    mat.pyplot.ylabel( 'Change (%)' )
-    mat.pyplot.grid  ( True         )
-    ax.yaxis.set_major_formatter( mat.ticker.PercentFormatter() )
+    # render in a separate process
+    future = get_render_pool().submit( render_chart, df, _info['ticker'].symbols )
+
+    return future.result( timeout=_RENDER_TIMEOUT )
+
+def get_chart_key( _info, dmonth ):
+
+    # last bar date and closes change whenever new data lands
+    history = _info['history']
+    symbols = sorted( _info['ticker'].symbols )
+    last    = np.nan_to_num( history.last( 'close', symbols ) ).round( 4 )
+    date    = history.index.max() if len( history.index ) > 0 else None
+
+    return ( tuple( symbols ), dmonth, _info.get( 'interval', '1d' ), date, tuple( last ) )
+
+def get_cached_chart( _info, dmonth ):
 
-    # save to file
-    mat.pyplot.savefig( '_tmp.png', bbox_inches='tight' )
+    key = get_chart_key( _info, dmonth )
+    ret = chart_cache.get_many( [ key ], lambda keys: { key: { 'png': get_chart( _info, dmonth ), 'file_id': None } } )
 
-    return '_tmp.png'
+    return ret[ key ]
 
-def crawl_finviz_df( url ):
+def get_render_pool():
 
-    session = requests.Session()
-    website = session.get(url, headers=headers, timeout=10, verify=False)
+    global render_pool
 
-    soup = BeautifulSoup(website.text, "lxml")
+    # spawn, since forking a process with running threads is unsafe
+    with render_pool_lock:
+        if render_pool is None:
+            render_pool = ProcessPoolExecutor( max_workers=_RENDER_WORKERS, mp_context=get_context( 'spawn' ), max_tasks_per_child=_RENDER_TASKS )
 
-    url_all1 = soup.find_all('a',  {'class':"screener-link-primary"})
-    url_all2 = soup.find_all('a',  {'class':"screener-link"})
-    td_col   = soup.find_all('td', {'class':"table-top cursor-pointer"})
+    return render_pool
 
-    col_list  = [ elem.text for elem in td_col ]
-    col_list  = col_list[1:] # remove No.
-    tick_list = [ elem.text for elem in url_all1 ]
-    n         = len( url_all2 )
-    ncol      = len( col_list )
+def render_chart( _df, _symbols ):
 
-    df = pd.DataFrame()
-    df[ col_list[0] ] = tick_list
+    global render_figure
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.ticker import PercentFormatter
+
+    # object-oriented API, no pyplot global state
+    if render_figure is None:
+        render_figure = Figure()
+        FigureCanvasAgg( render_figure )
+    fig = render_figure
+    fig.clear()
+    ax  = fig.add_subplot()
+
+    for option in _symbols:
+        ax.plot( _df.index, _df[ option ], label=option )
+
+    # customization
+    ax.set_xlabel( 'Date'       )
+    ax.set_ylabel( 'Change (%)' )
+    ax.grid      ( True         )
+    ax.legend()
+    ax.yaxis.set_major_formatter( PercentFormatter() )
+    fig.autofmt_xdate()
+
+    # save to memory
+    buf = io.BytesIO()
+    fig.savefig( buf, format='png', bbox_inches='tight' )
+
+    return buf.getvalue()
+
+class ScreenerParser( HTMLParser ):
+    """Collects the screener table header, ticker rows and total count while the page streams in."""
+
+    def __init__( self ):
+        super().__init__()
+        self.header = []
+        self.rows   = []
+        self.total  = None
+        self.row    = None      # cells of current <tr>
+        self.cell   = None      # text pieces of current <td>/<th>
+        self.head   = False     # current row is a header row
+        self.quote  = False     # current row links to a quote page
+        self.prev   = ''
+
+    def handle_starttag( self, tag, attrs ):
+        attrs = dict( attrs )
+        if tag == 'tr':
+            self.row   = []
+            self.head  = False
+            self.quote = False
+        elif tag in ( 'td', 'th' ) and self.row is not None:
+            self.cell  = []
+            self.head |= tag == 'th' or 'table-top' in ( attrs.get( 'class' ) or '' )
+        elif tag == 'a' and self.cell is not None and 'quote.ashx' in ( attrs.get( 'href' ) or '' ):
+            self.quote = True
+
+    def handle_endtag( self, tag ):
+        if tag in ( 'td', 'th' ) and self.cell is not None and self.row is not None:
+            self.row.append( ''.join( self.cell ).strip() )
+            self.cell = None
+        elif tag == 'tr' and self.row is not None:
+            if self.head and 'Ticker' in self.row and not self.header:
+                self.header = self.row
+            elif self.quote and self.header and len( self.row ) == len( self.header ):
+                self.rows.append( self.row )
+            self.row = None
+
+    def handle_data( self, data ):
+        if self.cell is not None: self.cell.append( data )
+
+        # "Total: </b>1234 #1" or "#1 / 1234 Total"
+        if self.total is None:
+            found = re.match( r'\s*(\d+)', data ) if self.prev.strip() == 'Total:' else re.search( r'/\s*(\d+)\s*Total', data )
+            if found: self.total = int( found.group(1) )
+        self.prev = data
+
+def fetch_screener_page( _url ):
+
+    parser = ScreenerParser()
+
+    # feed the parser as the page arrives
+    with finviz_session.get( _url, timeout=10, verify=False, stream=True ) as website:
+        website.raise_for_status()
+        website.encoding = website.encoding or 'utf-8'
+        for chunk in website.iter_content( chunk_size=16384, decode_unicode=True ):
+            parser.feed( chunk )
+    parser.close()
+
+    # block or error pages have no screener table, they must not be cached
+    if not parser.header: raise ValueError( f'no screener table in {_url}' )
+
+    return { 'header': parser.header, 'rows': parser.rows, 'total': parser.total }
+
+def get_screener_page( _url ):
+
+    # a failed fetch raises in the fetching thread, threads waiting on it get nothing
+    page = screener_cache.get_many( [ _url ], lambda keys: { _url: fetch_screener_page( _url ) } ).get( _url )
+    if page is None: raise ValueError( f'screener page failed: {_url}' )
+
+    return page
+
+def crawl_finviz_df( url, max_rows=None ):
+
+    first = get_screener_page( url )
+    rows  = list( first['rows'] )
+    size  = len( rows )
+
+    # remaining pages, fetched concurrently ( r is the 1-based first row )
+    total = first['total'] if first['total'] is not None else size
+    if max_rows is not None: total = min( total, max_rows )
+    if size > 0 and total > size:
+        urls    = [ f'{url}&r={start}' for start in range( size + 1, total + 1, size ) ]
+        futures = [ io_executor.submit( get_screener_page, elem ) for elem in urls ]
+        for elem in futures:
+            rows.extend( elem.result()['rows'] )
+
+    # drop No. column
+    df = pd.DataFrame( [ row[1:] for row in rows[:total] ], columns=first['header'][1:] )
 
-    # for each column
-    for idx, col in enumerate( col_list[1:] ):
-        val_list = [ url_all2[i].text for i in range( idx+1, n, ncol ) ]
-        df[ col ] = val_list
- 
     return df
 
+# -------------------------------------------------------------------------------------------------
+# Outbox
+# -------------------------------------------------------------------------------------------------
+
+class Outbox:
+    """Outgoing message queue keeping per-chat and global send budgets.
+
+    Pending messages for the same chat are merged into one message (split again
+    at the telegram length limit) when the chat's turn comes.
+    """
+
+    def __init__( self, rate=_SEND_RATE, burst=_SEND_BURST ):
+        self.rate     = rate
+        self.burst    = burst
+        self.tokens   = burst
+        self.refill   = time.monotonic()
+        self.pause    = 0.0         # global pause after a flood or network error
+        self.backoff  = 0.0         # last network error pause, 0 after a successful send
+        self.pending  = OrderedDict()   # ( chat_id, parse_mode ) -> [ ( text, enqueue time ) ]
+        self.chat_at  = {}          # chat_id -> earliest next send
+        self.cond     = threading.Condition()
+        self.bot      = None
+        self.thread   = None
+        self.sent     = 0
+        self.failed   = 0
+        self.lat_sum  = 0.0
+        self.lat_max  = 0.0
+
+    def start( self, bot ):
+        self.bot    = bot
+        self.thread = threading.Thread( target=self.run, name='outbox', daemon=True )
+        self.thread.start()
+
+    def put( self, chat_id, text, parse_mode=None ):
+        with self.cond:
+            self.pending.setdefault( ( chat_id, parse_mode ), [] ).append( ( text, time.monotonic() ) )
+            self.cond.notify()
+
+    def next_ready( self, now ):
+        # caller holds the lock, returns ( key, None ) or ( None, seconds to wait )
+        self.tokens = min( self.burst, self.tokens + ( now - self.refill ) * self.rate )
+        self.refill = now
+        if now < self.pause:  return None, self.pause - now
+        if self.tokens < 1:   return None, ( 1 - self.tokens ) / self.rate
+
+        wait = None
+        for key in self.pending:
+            at = self.chat_at.get( key[0], 0 )
+            if at <= now: return key, None
+            wait = at - now if wait is None else min( wait, at - now )
+
+        return None, wait
+
+    def run( self ):
+        while True:
+            with self.cond:
+                key, wait = self.next_ready( time.monotonic() )
+                if key is None:
+                    self.cond.wait( timeout=wait )
+                    continue
+
+                # merge everything pending for the chat, keep the rest in place
+                items = self.pending[ key ]
+                since = items[0][1]
+                parts = split_text( '\n'.join( elem[0] for elem in items ) )
+                if len( parts ) > 1: self.pending[ key ] = [ ( '\n'.join( parts[1:] ), since ) ]
+                else:                del self.pending[ key ]
+
+                self.tokens -= 1
+                self.chat_at[ key[0] ] = time.monotonic() + ( _GROUP_INTERVAL if key[0] < 0 else _CHAT_INTERVAL )
+
+            self.send( key, parts[0], since )
+
+    def send( self, key, text, since ):
+        try:
+            with stage_stats.time( 'send', 'run' ):
+                self.bot.send_message( key[0], text, parse_mode=key[1] )
+        except RetryAfter as e:
+            with self.cond: self.retry( key, text, since, e.retry_after )
+            return
+        except ( Unauthorized, BadRequest, ChatMigrated ):
+            # blocked, removed or rejected, sending it again cannot help
+            with self.cond: self.failed += 1
+            return
+        except NetworkError:
+            # timeouts and connection errors pass, wait longer after each one in a row
+            with self.cond:
+                self.backoff = min( _SEND_BACKOFF_MAX, 2 * self.backoff ) if self.backoff else _SEND_BACKOFF
+                self.retry( key, text, since, self.backoff )
+            return
+        except Exception:
+            with self.cond: self.failed += 1
+            return
+
+        latency = time.monotonic() - since
+        with self.cond:
+            self.backoff  = 0.0
+            self.sent    += 1
+            self.lat_sum += latency
+            self.lat_max  = max( self.lat_max, latency )
+
+    def retry( self, key, text, since, delay ):
+        # caller holds the lock, put it back in front and stop sending for a while
+        self.pending[ key ] = [ ( text, since ) ] + self.pending.get( key, [] )
+        self.pending.move_to_end( key, last=False )
+        self.pause = time.monotonic() + delay
+
+    def stats( self ):
+        with self.cond:
+            return {
+                'depth'  : sum( len( elem ) for elem in self.pending.values() ),
+                'chats'  : len( self.pending ),
+                'sent'   : self.sent,
+                'failed' : self.failed,
+                'latency': self.lat_sum / self.sent if self.sent > 0 else 0.0,
+                'max'    : self.lat_max,
+            }
+
+outbox = Outbox()
+
+# -------------------------------------------------------------------------------------------------
+# Webhook
+# -------------------------------------------------------------------------------------------------
+
+class WebhookHandler( BaseHTTPRequestHandler ):
+
+    def do_POST( self ):
+        hook = self.server.webhook
+        if self.path != hook.path:
+            self.send_error( 404 )
+            return
+        if hook.secret is not None and self.headers.get( 'X-Telegram-Bot-Api-Secret-Token' ) != hook.secret:
+            self.send_error( 403 )
+            return
+
+        try:
+            size = int( self.headers.get( 'Content-Length', 0 ) )
+        except ValueError:
+            size = -1
+        if size < 0:
+            self.send_error( 400 )
+            return
+        if size > _WEBHOOK_BODY:
+            self.send_error( 413 )
+            return
+        try:
+            data = json.loads( self.rfile.read( size ) )
+        except ValueError:
+            self.send_error( 400 )
+            return
+
+        # telegram retries refused updates, in order, after Retry-After
+        if not hook.put( data ):
+            self.send_response( 503 )
+            self.send_header( 'Retry-After', str( _WEBHOOK_RETRY ) )
+            self.send_header( 'Content-Length', '0' )
+            self.end_headers()
+            return
+
+        self.send_response( 200 )
+        self.send_header( 'Content-Length', '0' )
+        self.end_headers()
+
+    def log_message( self, format, *args ):
+        # no access log on stderr
+        pass
+
+class WebhookServer( ThreadingHTTPServer ):
+
+    daemon_threads     = True
+    request_queue_size = 128    # pending connections, telegram opens up to max_connections at once
+
+class Webhook:
+    """Telegram updates pushed to a local HTTP endpoint, handled by a fixed pool of workers.
+
+    Updates wait in a bounded queue; when it is full the request is refused with
+    503 and telegram delivers the update again later.
+    """
+
+    def __init__( self, workers=_WEBHOOK_WORKERS, depth=_WEBHOOK_QUEUE ):
+        self.workers    = workers
+        self.updates    = Queue( maxsize=depth )
+        self.dispatcher = None
+        self.server     = None
+        self.threads    = []
+        self.path       = '/'
+        self.secret     = None
+        self.lock       = threading.Lock()
+        self.accepted   = 0
+        self.refused    = 0
+        self.handled    = 0
+        self.failed     = 0
+
+    def start( self, dispatcher, addr, path='/', secret=None ):
+        self.dispatcher = dispatcher
+        self.path       = path
+        self.secret     = secret
+
+        for num in range( self.workers ):
+            thread = threading.Thread( target=self.run, name=f'webhook-{num}', daemon=True )
+            thread.start()
+            self.threads.append( thread )
+
+        self.server = WebhookServer( addr, WebhookHandler )
+        self.server.webhook = self
+        threading.Thread( target=self.server.serve_forever, name='webhook', daemon=True ).start()
+
+        return self.server
+
+    def stop( self ):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for _ in self.threads: self.updates.put( ( None, 0 ) )
+        for thread in self.threads: thread.join()
+        self.threads = []
+
+    def put( self, data ):
+        try:
+            self.updates.put_nowait( ( data, time.perf_counter() ) )
+        except Full:
+            with self.lock: self.refused += 1
+            return False
+        with self.lock: self.accepted += 1
+        return True
+
+    def run( self ):
+        while True:
+            data, since = self.updates.get()
+            if data is None: return
+            stage_stats.observe( 'webhook', 'queue', time.perf_counter() - since )
+
+            # handlers run in this thread, so busy workers keep the queue full
+            try:
+                self.dispatcher.process_update( Update.de_json( data, self.dispatcher.bot ) )
+            except Exception:
+                with self.lock: self.failed += 1
+                continue
+            with self.lock: self.handled += 1
+
+    def running( self ):
+        return self.server is not None
+
+    def stats( self ):
+        with self.lock:
+            return {
+                'depth'   : self.updates.qsize(),
+                'accepted': self.accepted,
+                'refused' : self.refused,
+                'handled' : self.handled,
+                'failed'  : self.failed,
+            }
+
+webhook = Webhook()
+
+# -------------------------------------------------------------------------------------------------
+# Feed
+# -------------------------------------------------------------------------------------------------
+
+class LiveQuotes:
+    """Quotes pushed by the feed, merged over the last polled quote of each symbol."""
+
+    def __init__( self, stale=_FEED_STALE ):
+        self.stale = stale
+        self.data  = {}             # symbol -> ( quote, monotonic time of last tick )
+        self.lock  = threading.Lock()
+
+    def update( self, _symbol, _fields ):
+        with self.lock:
+            prev  = self.data.get( _symbol )
+            base  = prev[0] if prev is not None else quote_cache.peek( _symbol )
+            quote = dict( base ) if isinstance( base, dict ) else {}
+            quote.update( _fields )
+            self.data[ _symbol ] = ( quote, time.monotonic() )
+
+        # shard processes read pushed quotes from the shared store
+        if shared_quotes is not None: shared_quotes.put_many( { _symbol: quote }, lambda val: self.stale )
+
+    def get_many( self, _symbols ):
+        # fresh quotes only, the rest is polled
+        now = time.monotonic()
+        with self.lock:
+            found = [ ( key, self.data.get( key ) ) for key in _symbols ]
+        return { key: elem[0] for key, elem in found if elem is not None and now - elem[1] < self.stale }
+
+    def stats( self ):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'size' : len( self.data ),
+                'fresh': sum( now - elem[1] < self.stale for elem in self.data.values() ),
+            }
+
+live_quotes = LiveQuotes()
+
+class QuoteFeed:
+    """Newline-delimited JSON quote stream over TCP, reconnected in the background.
+
+    Requests are { "subscribe": [ symbols ] }, ticks are { "symbol": ..., <Ticker.price fields> }.
+    """
+
+    def __init__( self, on_tick=None ):
+        self.on_tick   = on_tick
+        self.symbols   = set()
+        self.sock      = None
+        self.lock      = threading.Lock()
+        self.thread    = None
+        self.ticks     = 0
+        self.connected = False
+
+    def start( self, addr ):
+        self.addr   = addr
+        self.thread = threading.Thread( target=self.run, name='feed', daemon=True )
+        self.thread.start()
+
+    def send( self, _symbols ):
+        # caller holds the lock
+        if self.sock is None or not _symbols: return
+        try:
+            self.sock.sendall( ( json.dumps( { 'subscribe': sorted( _symbols ) } ) + '\n' ).encode() )
+        except OSError:
+            pass
+
+    def subscribe( self, _symbols ):
+        with self.lock:
+            new = set( _symbols ) - self.symbols
+            self.symbols |= new
+            self.send( new )
+
+    def run( self ):
+        while True:
+            try:
+                with socket.create_connection( self.addr, timeout=_FEED_RECONNECT ) as sock:
+                    sock.settimeout( None )
+                    with self.lock:
+                        self.sock      = sock
+                        self.connected = True
+                        self.send( self.symbols )
+                    for line in sock.makefile( 'r', encoding='utf-8' ):
+                        self.handle( line )
+            except OSError:
+                pass
+            with self.lock:
+                self.sock      = None
+                self.connected = False
+            time.sleep( _FEED_RECONNECT )
+
+    def handle( self, _line ):
+        try:
+            msg = json.loads( _line )
+        except ValueError:
+            return
+        symbol = msg.pop( 'symbol', None ) if isinstance( msg, dict ) else None
+        if not symbol: return
+
+        live_quotes.update( symbol, msg )
+        self.ticks += 1
+        if self.on_tick is not None: self.on_tick( symbol )
+
+    def stats( self ):
+        with self.lock:
+            return { 'connected': self.connected, 'symbols': len( self.symbols ), 'ticks': self.ticks }
+
+class TickTrigger:
+    """Batches ticked symbols and runs the /run scan for chats watching them."""
+
+    def __init__( self, debounce=_FEED_DEBOUNCE ):
+        self.debounce = debounce
+        self.dirty    = set()
+        self.cond     = threading.Condition()
+        self.thread   = None
+
+    def start( self ):
+        self.thread = threading.Thread( target=self.run, name='ticks', daemon=True )
+        self.thread.start()
+
+    def put( self, _symbol ):
+        with self.cond:
+            self.dirty.add( _symbol )
+            self.cond.notify()
+
+    def run( self ):
+        while True:
+            with self.cond:
+                while not self.dirty: self.cond.wait()
+
+            # collect the ticks that follow closely
+            time.sleep( self.debounce )
+            with self.cond:
+                dirty, self.dirty = self.dirty, set()
+
+            with subscribers_lock:
+                chats = list( subscribers.keys() )
+            chats = [ chat_id for chat_id in chats if dirty & set( get_chat_port( chat_id ) ) ]
+            if not chats: continue
+            try:
+                scan_chats( chats, 'push', _fetch=False )
+            except Exception:
+                # keep the trigger alive, the next tick retries
+                pass
+
+tick_trigger = TickTrigger()
+quote_feed   = QuoteFeed( on_tick=tick_trigger.put )
+
+# -------------------------------------------------------------------------------------------------
+# Shards
+# -------------------------------------------------------------------------------------------------
+
+def init_shard( _shard, _setup=None ):
+
+    global shard_id, shared_quotes
+
+    # runs once in every shard process
+    shard_id      = _shard
+    shared_quotes = SharedQuotes( _SHARED_QUOTES )
+    if _setup is not None: _setup()
+
+def start_shards( _num, _setup=None ):
+
+    global shared_quotes
+
+    # one process per shard, so a symbol's bars and indicator state stay in one place
+    shared_quotes = SharedQuotes( _SHARED_QUOTES )
+    context       = get_context( 'spawn' )
+    for idx in range( _num ):
+        shards.append( ProcessPoolExecutor( max_workers=1, mp_context=context, initializer=init_shard, initargs=( idx, _setup ) ) )
+
+def stop_shards():
+
+    while shards:
+        shards.pop().shutdown( wait=True, cancel_futures=True )
+
+def get_shard( _key ):
+
+    # stable across processes and restarts, unlike hash()
+    return zlib.crc32( str( _key ).encode() ) % len( shards )
+
+def shard_metric( _port, _interval, _fetch ):
+
+    info = get_source( _port, _interval, _fetch )
+    return get_metric( info ), info['errors']
+
+def shard_chart( _port, _interval, _dmonth ):
+
+    info  = get_bars( _port, _interval )
+    chart = get_cached_chart( info, _dmonth )
+    return get_chart_key( info, _dmonth ), chart['png']
+
+def source_metric( _port, _interval='1d', _fetch=True, _command=None ):
+    """Return ( metric, { symbol: error } ) for _port, computed by the shards owning its symbols when running sharded."""
+    if not shards:
+        with stage_stats.time( 'fetch', _command ):
+            info = get_source( _port, _interval, _fetch )
+        with stage_stats.time( 'metric', _command ):
+            return get_metric( info ), info['errors']
+
+    groups = {}
+    for symbol in _port:
+        groups.setdefault( get_shard( symbol.upper() ), [] ).append( symbol )
+
+    with stage_stats.time( 'shard', _command ):
+        futures = [ shards[ idx ].submit( shard_metric, symbols, _interval, _fetch ) for idx, symbols in groups.items() ]
+        results = [ elem.result() for elem in futures ]
+
+    # requested order
+    metric = pd.concat( [ elem[0] for elem in results ], axis=1 )
+    metric = metric[ [ elem for elem in dict.fromkeys( symbol.upper() for symbol in _port ) if elem in metric.columns ] ]
+    errors = { key: val for elem in results for key, val in elem[1].items() }
+
+    return metric, errors
+
+def get_port_chart( _port, _interval, _dmonth, _chat_id ):
+
+    if not shards:
+        # the cache key comes from the stored bars, quotes are not needed
+        with stage_stats.time( 'fetch' ):
+            info = get_bars( _port, _interval )
+        with stage_stats.time( 'chart' ):
+            return get_cached_chart( info, _dmonth )
+
+    # charts of one chat are drawn by the same shard
+    with stage_stats.time( 'shard' ):
+        key, png = shards[ get_shard( _chat_id ) ].submit( shard_chart, _port, _interval, _dmonth ).result( timeout=_RENDER_TIMEOUT )
+
+    # uploaded file ids are kept here
+    return chart_cache.get_many( [ key ], lambda keys: { key: { 'png': png, 'file_id': None } } )[ key ]
+
+# -------------------------------------------------------------------------------------------------
+# Alerts
+# -------------------------------------------------------------------------------------------------
+
+class AlertEngine:
+    """Edge-triggered filter state per ( chat, symbol, rule ), only enter and exit transitions are reported."""
+
+    def __init__( self, cooldown=_ALERT_COOLDOWN, hysteresis=_ALERT_HYSTERESIS ):
+        self.cooldown    = cooldown
+        self.hysteresis  = hysteresis   # measure -> band an active rule must clear to exit
+        self.states      = {}           # chat_id -> arrays over ( rules x symbols )
+        self.lock        = threading.Lock()
+        self.evaluated   = 0
+        self.transitions = 0
+
+    def align( self, _state, _keys, _symbols ):
+        # carry state over when the watchlist or the rules change
+        if _state is not None and _state['keys'] == _keys and _state['symbols'] == _symbols: return _state
+
+        shape = ( len( _keys ), len( _symbols ) )
+        new   = {
+            'keys'    : _keys,
+            'symbols' : _symbols,
+            'thr'     : np.full( len( _keys ), np.nan ),
+            'value'   : np.full( shape, np.nan ),
+            'active'  : np.zeros( shape, dtype=bool ),
+            'notified': np.zeros( shape, dtype=bool ),
+            'sent'    : np.full( shape, -np.inf ),
+        }
+        if _state is None: return new
+
+        rows = [ ( idx, _state['keys'].index( key ) ) for idx, key in enumerate( _keys ) if key in _state['keys'] ]
+        pos  = { symbol: idx for idx, symbol in enumerate( _state['symbols'] ) }
+        cols = [ ( idx, pos[ symbol ] ) for idx, symbol in enumerate( _symbols ) if symbol in pos ]
+        if rows and cols:
+            dst_r, src_r = map( list, zip( *rows ) )
+            dst_c, src_c = map( list, zip( *cols ) )
+            new['thr'][ dst_r ] = _state['thr'][ src_r ]
+            for name in [ 'value', 'active', 'notified', 'sent' ]:
+                new[ name ][ np.ix_( dst_r, dst_c ) ] = _state[ name ][ np.ix_( src_r, src_c ) ]
+
+        return new
+
+    def evaluate( self, _chat_id, _metric, _params, _now=None ):
+        """Return alert lines for rules that started or stopped matching since the last call."""
+        now     = time.time() if _now is None else _now
+        rules   = get_rules()
+        thr     = get_thresholds( rules, _params )
+        symbols = list( _metric.columns )
+        value   = _metric.reindex( rules['measure'] ).to_numpy( dtype=float )
+
+        with self.lock:
+            state = self.align( self.states.get( _chat_id ), rules['key'], symbols )
+            self.states[ _chat_id ] = state
+
+            # only symbols with a changed measure, or all when a threshold changed
+            same_val = ( value == state['value'] ) | ( np.isnan( value ) & np.isnan( state['value'] ) )
+            same_thr = ( thr == state['thr'] ) | ( np.isnan( thr ) & np.isnan( state['thr'] ) )
+            cols     = np.nonzero( ( ~same_val | ~same_thr[:, None] ).any( axis=0 ) )[0]
+            state['value'] = value
+            state['thr'  ] = thr
+            if len( cols ) == 0: return []
+            self.evaluated += len( cols )
+
+            # enter above the threshold, exit only below threshold - band, missing values keep the state
+            mul   = rules['mul'][:, None]
+            band  = np.array( [ self.hysteresis.get( elem, 0.0 ) for elem in rules['measure'] ] )[:, None]
+            score = value[:, cols] * mul
+            on    = score > ( thr[:, None] * mul )
+            off   = score <= ( thr[:, None] * mul ) - band
+            for idx, allowed in enumerate( rules['symbols'] ):
+                if allowed is not None:
+                    inside       = np.array( [ symbols[ col ] in allowed for col in cols ] )
+                    on [ idx ]  &= inside
+                    off[ idx ]  |= ~inside
+
+            active = state['active'][:, cols]
+            enter  = on & ~active
+            leave  = off & active
+
+            # cooldown suppresses repeated enters, a suppressed enter has no exit message either
+            desc = []
+            for col, idx in zip( *np.nonzero( ( enter | leave ).T ) ):
+                pos, symbol = cols[ col ], symbols[ cols[ col ] ]
+                self.transitions += 1
+                if enter[ idx, col ]:
+                    notify = now - state['sent'][ idx, pos ] >= self.cooldown
+                    state['active'  ][ idx, pos ] = True
+                    state['notified'][ idx, pos ] = notify
+                    if notify:
+                        state['sent'][ idx, pos ] = now
+                        desc.append( format_hit( symbol, rules, idx, value[ idx, pos ], thr[ idx ] ) )
+                else:
+                    if state['notified'][ idx, pos ]:
+                        desc.append( format_exit( symbol, rules, idx, value[ idx, pos ], thr[ idx ] ) )
+                    state['active'  ][ idx, pos ] = False
+                    state['notified'][ idx, pos ] = False
+
+        return desc
+
+    def reset( self, _chat_id ):
+        with self.lock:
+            self.states.pop( _chat_id, None )
+
+    def stats( self ):
+        with self.lock:
+            return {
+                'chats'      : len( self.states ),
+                'active'     : sum( int( elem['active'].sum() ) for elem in self.states.values() ),
+                'evaluated'  : self.evaluated,
+                'transitions': self.transitions,
+            }
+
+alert_engine = AlertEngine()
+
+# -------------------------------------------------------------------------------------------------
+# Scheduler
+# -------------------------------------------------------------------------------------------------
+
+def align_interval( _seconds ):
+
+    # multiple of scan tick, at least one tick
+    ticks = max( 1, -( -_seconds // _SCAN_TICK ) )
+    return ticks * _SCAN_TICK
+
+def next_aligned( _interval, _now ):
+
+    # wall-clock aligned, so chats with the same interval share scans
+    return ( _now // _interval + 1 ) * _interval
+
+def load_holidays():
+
+    # one date per line, an optional time is an early close, '#' starts a comment
+    ret = {}
+    if not os.path.isfile( _HOLIDAY_FILE ): return ret
+    with open( _HOLIDAY_FILE, 'r' ) as fp:
+        for line in fp:
+            elem = line.split( '#' )[0].split()
+            if not elem: continue
+            ret[ date.fromisoformat( elem[0] ) ] = elem[1] if len( elem ) > 1 else None
+
+    return ret
+
+def get_sessions( _day ):
+
+    # [ ( name, start, end ) ] of a trading day as timestamps, empty when closed
+    if _day.weekday() >= 5: return []
+    if _day in holidays and holidays[ _day ] is None: return []
+
+    ret = []
+    for name, ( start, end ) in _SESSIONS.items():
+        # an early close ends the regular session and starts the post session
+        if _day in holidays and name == 'regular': end   = holidays[ _day ]
+        if _day in holidays and name == 'post':    start = holidays[ _day ]
+        bounds = [ datetime.combine( _day, datetime.strptime( elem, '%H:%M' ).time(), _MARKET_TZ ).timestamp() for elem in ( start, end ) ]
+        ret.append( ( name, bounds[0], bounds[1] ) )
+
+    return ret
+
+def get_session( _now ):
+
+    for name, start, end in get_sessions( datetime.fromtimestamp( _now, _MARKET_TZ ).date() ):
+        if start <= _now < end: return name
+
+    return 'closed'
+
+def next_session_start( _now ):
+
+    # first session start after _now, within two weeks
+    day = datetime.fromtimestamp( _now, _MARKET_TZ ).date()
+    for offset in range( 14 ):
+        for name, start, end in get_sessions( day + timedelta( days=offset ) ):
+            if start > _now: return start
+
+    return _now + 86400
+
+def get_interval( _sub, _session ):
+
+    # effective seconds between scans, None while paused
+    factor = _SESSION_FACTOR.get( _session )
+    if factor is None: return None
+    if _sub.get( 'volatile' ) and _session == 'regular':
+        return align_interval( _sub['interval'] // _VOLATILE_SPEEDUP )
+
+    return align_interval( _sub['interval'] * factor )
+
+def schedule_next( _sub, _now ):
+
+    interval = get_interval( _sub, get_session( _now ) )
+    if interval is None:
+        # resume on the scan grid once a session starts
+        return align_interval( next_session_start( _now ) )
+
+    return next_aligned( interval, _now )
+
+def add_subscriber( _chat_id, _seconds ):
+
+    interval = align_interval( _seconds )
+    with subscribers_lock:
+        existed = _chat_id in subscribers
+        sub     = { 'interval': interval, 'volatile': False }
+        sub['next'] = schedule_next( sub, time.time() )
+        subscribers[ _chat_id ] = sub
+
+    return existed
+
+def remove_subscriber( _chat_id ):
+
+    alert_engine.reset( _chat_id )
+    with subscribers_lock:
+        return subscribers.pop( _chat_id, None ) is not None
+
+def pop_due_subscribers( _now ):
+
+    # return due chats and move their next run forward, nothing runs while the market is closed
+    due     = []
+    session = get_session( _now )
+    with subscribers_lock:
+        for chat_id, sub in subscribers.items():
+            if sub['next'] > _now + _SCAN_TICK / 2: continue
+            if _SESSION_FACTOR.get( session ) is not None: due.append( chat_id )
+            sub['next'] = schedule_next( sub, _now )
+
+    return due
+
+def set_volatile( _chat_id, _volatile ):
+
+    # reschedule when a chat starts or stops moving fast
+    with subscribers_lock:
+        sub = subscribers.get( _chat_id )
+        if sub is None or sub['volatile'] == _volatile: return
+        sub['volatile'] = _volatile
+        sub['next']     = min( sub['next'], schedule_next( sub, time.time() ) )
+
+def get_chat_params( _chat_id ):
+
+    return state_store.get( _chat_id )
+
+def get_chat_port( _chat_id ):
+
+    return get_chat_params( _chat_id )['port']
+
+def ensure_scan_job( _job_queue ):
+
+    # single repeating job shared by all subscribers, aligned to the tick grid
+    if _job_queue.get_jobs_by_name( _SCAN_JOB ): return
+    first = next_aligned( _SCAN_TICK, time.time() ) - time.time()
+    _job_queue.run_repeating( periodic_filter, _SCAN_TICK, first=first, name=_SCAN_JOB )
+
 # -------------------------------------------------------------------------------------------------
 # Callbacks
 # -------------------------------------------------------------------------------------------------
 
+def edit_message( _msg, _text ):
+
+    try:
+        _msg.edit_text( _text, parse_mode = "HTML" )
+    except BadRequest:
+        # e.g. message is not modified
+        pass
+
+def pop_interval( _args ):
+
+    # trailing bar size argument, e.g. /rsi AAPL 5m
+    if len( _args ) > 0 and _args[-1].lower() in _INTERVALS:
+        return _args[:-1], _args[-1].lower()
+
+    return _args, '1d'
+
+def reply_progressive( _message, _port, _render, _empty=None, _interval='1d', _stage='format' ):
+    """Reply with _render( metric ), editing one message as chunks of _port complete."""
+    port   = [ elem.upper() for elem in _port ]
+    total  = -( -len( port ) // _STREAM_CHUNK )
+    msg    = None
+    last   = 0
+    done   = 0
+    metric = []
+    errors = {}
+
+    for chunk, error in stream_source( port, _interval ):
+        metric.append( chunk )
+        errors.update( error )
+        done += 1
+
+        # throttle edits, the last chunk is always shown
+        if done < total and time.monotonic() - last < _EDIT_INTERVAL: continue
+        last = time.monotonic()
+
+        with stage_stats.time( _stage ):
+            merged = pd.concat( metric, axis=1 )
+            merged = merged[ [ elem for elem in port if elem in merged.columns ] ]
+            desc   = _render( merged )
+        if desc == [] and _empty is not None and done == total: desc = [ _empty ]
+        desc  += get_failed( { 'errors': errors } )
+        if desc == []: desc = [ 'No results' ]
+
+        if done < total:
+            footer = f'<i>{done}/{total} loaded</i>'
+            text   = split_text( '\n'.join( desc ), _MESSAGE_LIMIT - len( footer ) - 1 )[:1] + [ footer ]
+            text   = '\n'.join( text )
+            with stage_stats.time( 'send' ):
+                if msg is None: msg = _message.reply_text( text, parse_mode = "HTML" )
+                else:           edit_message( msg, text )
+        else:
+            parts = split_text( '\n'.join( desc ) )
+            with stage_stats.time( 'send' ):
+                if msg is None: _message.reply_text( parts[0], parse_mode = "HTML" )
+                else:           edit_message( msg, parts[0] )
+                for elem in parts[1:]:
+                    _message.reply_text( elem, parse_mode = "HTML" )
+
+
 def help(update: Update, context: CallbackContext) -> None:
     """Sends explanation on how to use the bot."""
     
@@ -447,49 +2845,56 @@ def help(update: Update, context: CallbackContext) -> None:
     text += '*Filter*\n'
     text += escape_markdown( '/run <seconds>: run filter\n' +
                              '/stop: stop filter\n' +
-                             '/filter: run filter once\n' +
+                             '/filter [<intv>]: run filter once\n' +
                              '/thres: show thresholds\n' +
                              '/set <rsi|day> <L> <H>: set thres.\n' +
-                             '/job: show remaining time\n' )
+                             '/job: show remaining time\n' +
+                             '/cache: show cache stat\n' +
+                             '/queue: show alert queue stat\n' +
+                             '/stats: show stage timings (admin)\n' )
     text += '\n'                             
     
     text += '*Information*\n'
     text += escape_markdown( '/price [<tickers>]: show prices\n' +
                              '/pre [<tickers>]: show pre-prices\n' +
                              '/post [<tickers>]: show post-prices\n' +
-                             '/rsi [<tickers>]: show rsi values\n' +
+                             '/rsi [<tickers>] [<intv>]: show rsi\n' +
                              '/info ticker: show information\n' +
-                             '/draw [<tickers>] <months>: chart\n' +
+                             '/draw [<tickers>] <months> [<intv>]: chart\n' +
                              '/index: show index stat\n' +
                              '/sector: show sector stat\n' )
     text += '\n'                             
     
     text += '*Screener*\n'
-    text += escape_markdown( '/oversold: show 10 RSI<40 tickers\n' +
-                             '/overbought: show 10 RSI>60 tickers\n' )
+    text += escape_markdown( '/oversold [<n>]: show RSI<40 tickers\n' +
+                             '/overbought [<n>]: show RSI>60 tickers\n' +
+                             '/screen <cond> ... [<n>]: screen universe\n' )
 
     update.message.reply_text( text, parse_mode="MarkdownV2" )
 
 def ticker(update: Update, context: CallbackContext) -> None:
     """Show tickers"""
+    params = get_chat_params( update.message.chat_id )
     desc   = params['port']
     text = '<code>'+' '.join( desc )+'</code>'
     update.message.reply_text( text, parse_mode = "HTML" )
 
 def add(update: Update, context: CallbackContext) -> None:
     """Add tickers"""
+    params = get_chat_params( update.message.chat_id )
     if len( context.args ) > 0:
         t = Ticker( context.args, verify=False, validate=True )
         for elem in context.args:
             if elem.upper() in t.symbols and elem.upper() not in params['port']:
                 params['port'].append( elem.upper() )
-        save_params( params )
+        save_params( update.message.chat_id )
         ticker( update, context )
     else:
         update.message.reply_text('Usage: /add <tickers> to add tickers')
 
 def delete(update: Update, context: CallbackContext) -> None:
     """Del tickers"""
+    params = get_chat_params( update.message.chat_id )
     if len( context.args ) > 0:
         for elem in context.args:
             params['port'].remove( elem.upper() )
@@ -499,48 +2904,47 @@ def delete(update: Update, context: CallbackContext) -> None:
             update.message.reply_text( 'At least one ticker should exist, SPY is added by default' )
             params['port'].append( 'SPY' )
 
-        save_params( params )
+        save_params( update.message.chat_id )
         ticker( update, context )
     else:
         update.message.reply_text('Usage: /del <tickers> to del tickers')
 
-def periodic_filter(context: CallbackContext) -> None:
-    """Run filter."""
-    global prev_desc
+def scan_chats( _chats, _command='run', _fetch=True ):
 
-    job = context.job
+    # fetch and compute once for the union of all portfolios
+    ports   = { chat_id: get_chat_port( chat_id ) for chat_id in _chats }
+    symbols = list( dict.fromkeys( elem for port in ports.values() for elem in port ) )
+    if _FEED_ADDR is not None: quote_feed.subscribe( symbols )
 
-    # get source
-    info = get_source( params['port'] )
+    # get source and metric
+    metric, errors = source_metric( symbols, _fetch=_fetch, _command=_command )
 
-    # get metric
-    metric = get_metric( info )
+    for chat_id in _chats:
 
-    # apply filter
-    desc = apply_filter( metric )
+        with subscribers_lock:
+            if chat_id not in subscribers: continue
+
+        # only rules that started or stopped matching
+        with stage_stats.time( 'filter', _command ):
+            cols = [ elem for elem in ports[ chat_id ] if elem in metric.columns ]
+            desc = alert_engine.evaluate( chat_id, metric[ cols ], get_chat_params( chat_id ) )
 
-    # output when only entry changes
-    if check_diff( prev_desc, desc ):
         if desc != []:
-            text = '\n'.join( desc )
-            context.bot.send_message( job.context, text, parse_mode = "HTML" )
-        else:
-            context.bot.send_message( job.context, "No filtered results" )
+            outbox.put( chat_id, '\n'.join( desc ), parse_mode = "HTML" )
 
-    # update detection
-    prev_desc = [ elem[:elem.index('(')] for elem in desc ]
+        # big daily moves tighten polling
+        move = np.abs( metric.loc[ 'regularMarketChangePercent', cols ].to_numpy( dtype=float ) )
+        set_volatile( chat_id, bool( ( move >= _VOLATILE_MOVE ).any() ) )
 
-def remove_job_if_exists(name: str, context: CallbackContext) -> bool:
-    """Remove job with given name. Returns whether job was removed."""
-    current_jobs = context.job_queue.get_jobs_by_name(name)
-    if not current_jobs:
-        return False
-    for job in current_jobs:
-        job.schedule_removal()
-    return True
+def periodic_filter(context: CallbackContext) -> None:
+    """Run filter for every subscriber due at this tick."""
+    due = pop_due_subscribers( time.time() )
+    if not due: return
+
+    scan_chats( due )
 
 def runft(update: Update, context: CallbackContext) -> None:
-    """Add a job to the queue."""
+    """Subscribe the chat to the shared scan."""
     chat_id = update.message.chat_id
     try:
         # args[0] should contain the time for the timer in seconds
@@ -549,12 +2953,16 @@ def runft(update: Update, context: CallbackContext) -> None:
             update.message.reply_text('Sorry we can not go back to future!')
             return
 
-        job_removed = remove_job_if_exists(str(chat_id), context)
-        context.job_queue.run_repeating( periodic_filter, due, context=chat_id, name=str(chat_id) )
+        job_removed = add_subscriber( chat_id, due )
+        ensure_scan_job( context.job_queue )
 
         text = 'Timer successfully set!'
         if job_removed:
             text += ' Old one was removed.'
+        if align_interval( due ) != due:
+            text += f' Interval is rounded to {align_interval( due )} seconds.'
+        if get_session( time.time() ) == 'closed':
+            text += ' Market is closed, polling starts with the next session.'
         update.message.reply_text(text)
 
     except (IndexError, ValueError):
@@ -563,116 +2971,111 @@ def runft(update: Update, context: CallbackContext) -> None:
 def stop(update: Update, context: CallbackContext) -> None:
     """Remove the job if the user changed their mind."""
     chat_id = update.message.chat_id
-    job_removed = remove_job_if_exists(str(chat_id), context)
+    job_removed = remove_subscriber( chat_id )
+
+    # the scan job stays, it is a no-op without due chats and removing it races with /run
     text = 'Timer successfully cancelled!' if job_removed else 'You have no active timer.'
     update.message.reply_text(text)
 
 def price(update: Update, context: CallbackContext) -> None:
     """Show latest price"""
+    params = get_chat_params( update.message.chat_id )
     if len( context.args ) > 0:
         port_list = Ticker( context.args, verify=False, validate=True ).symbols
         if port_list == []: port_list = params['port']
     else:
         port_list = params['port']
 
-    info   = get_source( port_list )
-    metric = get_metric( info      )
-    desc   = get_price ( metric    )
-    text   = '\n'.join ( desc      )
-    update.message.reply_text( text, parse_mode = "HTML" )
+    reply_progressive( update.message, port_list, get_price )
 
 def pre(update: Update, context: CallbackContext) -> None:
     """Show latest price"""
+    params = get_chat_params( update.message.chat_id )
     if len( context.args ) > 0:
         port_list = Ticker( context.args, verify=False, validate=True ).symbols
         if port_list == []: port_list = params['port']
     else:
         port_list = params['port']
 
-    info   = get_source( port_list )
-    metric = get_metric( info      )
-    desc   = get_pre   ( metric    )
-    text   = '\n'.join ( desc      )
-    update.message.reply_text( text, parse_mode = "HTML" )    
+    reply_progressive( update.message, port_list, get_pre )
 
 def post(update: Update, context: CallbackContext) -> None:
     """Show latest price"""
+    params = get_chat_params( update.message.chat_id )
     if len( context.args ) > 0:
         port_list = Ticker( context.args, verify=False, validate=True ).symbols
         if port_list == []: port_list = params['port']
     else:
         port_list = params['port']
 
-    info   = get_source( port_list )
-    metric = get_metric( info      )
-    desc   = get_post  ( metric    )
-    text   = '\n'.join ( desc      )
-    update.message.reply_text( text, parse_mode = "HTML" )  
+    reply_progressive( update.message, port_list, get_post )
 
 def rsi(update: Update, context: CallbackContext) -> None:
     """Show latest rsi"""
-    if len( context.args ) > 0:
-        port_list = Ticker( context.args, verify=False, validate=True ).symbols
+    params = get_chat_params( update.message.chat_id )
+    args, interval = pop_interval( context.args )
+    if len( args ) > 0:
+        port_list = Ticker( args, verify=False, validate=True ).symbols
         if port_list == []: port_list = params['port']
     else:
         port_list = params['port']
 
-    info   = get_source( port_list )
-    metric = get_metric( info      )
-    desc   = get_rsi   ( metric    )
-    text   = '\n'.join ( desc      )
-    update.message.reply_text( text, parse_mode = "HTML" )       
+    reply_progressive( update.message, port_list, get_rsi, _interval=interval )
 
 def info(update: Update, context: CallbackContext) -> None:
     """Show information of single ticker"""
     if len( context.args ) > 0:
-        desc = get_info ( context.args[0] )
-        text = '\n'.join( desc            )
-        update.message.reply_text( text, parse_mode = "HTML" )
+        with stage_stats.time( 'fetch' ):
+            desc = get_info ( context.args[0] )
+            text = '\n'.join( desc            )
+        with stage_stats.time( 'send' ):
+            update.message.reply_text( text, parse_mode = "HTML" )
     else:
         update.message.reply_text( 'Usage: /info ticker: show information' )
 
 def draw(update: Update, context: CallbackContext) -> None:
     """Draw chart"""
+    params = get_chat_params( update.message.chat_id )
     try:
-        if len( context.args ) > 1:
-            port_list =      context.args[:-1]
-            dmonth    = int( context.args[ -1] )
-        elif len( context.args ) == 1:
+        args, interval = pop_interval( context.args )
+        if len( args ) > 1:
+            port_list =      args[:-1]
+            dmonth    = int( args[ -1] )
+        elif len( args ) == 1:
             port_list =      params['port']
-            dmonth    = int( context.args[ -1] )
+            dmonth    = int( args[ -1] )
         else:
             port_list = params['port']
             dmonth    = 1
-        
-        info   = get_source( port_list    )
-        chart  = get_chart ( info, dmonth )
 
-        update.message.reply_photo( photo=open( chart, 'rb') )
-        os.remove( chart )
+        chart  = get_port_chart( port_list, interval, dmonth, update.message.chat_id )
+
+        # telegram keeps uploaded photos, resend by file_id
+        with stage_stats.time( 'send' ):
+            if chart['file_id'] is not None:
+                update.message.reply_photo( photo=chart['file_id'] )
+            else:
+                msg = update.message.reply_photo( photo=io.BytesIO( chart['png'] ) )
+                chart['file_id'] = msg.photo[-1].file_id
     except:
-        update.message.reply_text( 'Usage: /draw [<tickers>] <months>: draw chart' )
+        update.message.reply_text( 'Usage: /draw [<tickers>] <months> [<interval>]: draw chart' )
 
 def filter(update: Update, context: CallbackContext) -> None:
     """Run detector"""
-    info   = get_source  ( params['port'] )
-    metric = get_metric  ( info )    
-    desc   = apply_filter( metric )
-
-    if desc != []:
-        text = '\n'.join( desc )
-        update.message.reply_text( text, parse_mode = "HTML" )
-    else:
-        update.message.reply_text( "No filtered results" )
+    params = get_chat_params( update.message.chat_id )
+    args, interval = pop_interval( context.args )
+    reply_progressive( update.message, params['port'], lambda metric: apply_filter( metric, params ), "No filtered results", interval, 'filter' )
 
 def thres(update: Update, context: CallbackContext) -> None:
     """Show thresholds."""
+    params = get_chat_params( update.message.chat_id )
     r1 = params['RSI_L'];     r2 = params['RSI_H'];     text  = f'<code>RSI {r1:5.1f} {r2:5.1f}</code>\n'
     r1 = params['DAY_L']*100; r2 = params['DAY_H']*100; text += f'<code>DAY {r1:5.1f} {r2:5.1f}</code>'
     update.message.reply_text( text, parse_mode = "HTML" )
 
 def setthr(update: Update, context: CallbackContext) -> None:
     """Set thresholds."""
+    params = get_chat_params( update.message.chat_id )
     try:
         if context.args[0].upper() == 'RSI':
             try:
@@ -688,7 +3091,7 @@ def setthr(update: Update, context: CallbackContext) -> None:
                 pass
 
         # save parameter
-        save_params( params )    
+        save_params( update.message.chat_id )    
 
         # show current threshold
         thres( update, context )
@@ -697,59 +3100,208 @@ def setthr(update: Update, context: CallbackContext) -> None:
 
 def index(update: Update, context: CallbackContext) -> None:
     """Show index price"""
-    info   = get_source( index_tickers )
-    metric = get_metric( info )
-    desc   = get_index ( metric )
-    text   = '\n'.join( desc )
-    update.message.reply_text( text, parse_mode = "HTML" )
+    metric, errors = source_metric( list( index_tickers.keys() ) )
+    with stage_stats.time( 'format' ):
+        desc   = get_index ( metric ) + get_failed( { 'errors': errors } )
+        text   = '\n'.join( desc )
+    with stage_stats.time( 'send' ):
+        update.message.reply_text( text, parse_mode = "HTML" )
 
 def sector(update: Update, context: CallbackContext) -> None:
     """Show sector price"""
-    info   = get_source( sector_tickers )
-    metric = get_metric( info )
-    desc   = get_sector( metric )
-    text   = '\n'.join( desc )
-    update.message.reply_text( text, parse_mode = "HTML" )
+    metric, errors = source_metric( list( sector_tickers.keys() ) )
+    with stage_stats.time( 'format' ):
+        desc   = get_sector( metric ) + get_failed( { 'errors': errors } )
+        text   = '\n'.join( desc )
+    with stage_stats.time( 'send' ):
+        update.message.reply_text( text, parse_mode = "HTML" )
 
 def job(update: Update, context: CallbackContext) -> None:
     """Show currently scheduled job"""
-    chat_id  = update.message.chat_id
-    job_list = context.job_queue.get_jobs_by_name( name=str(chat_id) )
+    chat_id = update.message.chat_id
+    with subscribers_lock:
+        sub = subscribers.get( chat_id )
 
-    if len( job_list ) == 0:
+    if sub is None:
         update.message.reply_text( "No currently scheduled job" )
+        return
+
+    now     = time.time()
+    remain  = max( 0, int( sub['next'] - now ) )
+    session = get_session( now )
+    text    = f'Job will be executed after {remain} seconds'
+
+    # effective schedule for the current session
+    interval = get_interval( sub, session )
+    if interval is None:
+        at    = datetime.fromtimestamp( sub['next'], _MARKET_TZ ).strftime( '%a %H:%M %Z' )
+        text += f'\nMarket closed, polling resumes {at}'
     else:
-        job    = job_list[0]
-        date_n = job.next_t
-        date_t = datetime.now( timezone.utc )
-        remain = ( date_n - date_t ).seconds
-        update.message.reply_text( f'Job will be executed after {remain} seconds' )
+        text += f'\n{session.capitalize()} session, every {interval} seconds'
+        if sub['volatile'] and session == 'regular': text += ' (volatile)'
+    update.message.reply_text( text )
+
+def cache(update: Update, context: CallbackContext) -> None:
+    """Show cache statistics"""
+    text = '<code>       Size   Hits Misses  Ratio</code>'
+    for name, elem in [ ( 'Quote', quote_cache ), ( 'Chart', chart_cache ) ]:
+        st    = elem.stats()
+        text += f'\n<code>{name:5} {st["size"]:5d} {st["hits"]:6d} {st["misses"]:6d} {st["ratio"]*100:5.1f}%</code>'
+    if _FEED_ADDR is not None:
+        st    = quote_feed.stats()
+        text += f'\n<code>Feed  {"up" if st["connected"] else "down"}, {st["symbols"]} symbols, {st["ticks"]} ticks, {live_quotes.stats()["fresh"]} live</code>'
+    update.message.reply_text( text, parse_mode = "HTML" )
+
+def stats(update: Update, context: CallbackContext) -> None:
+    """Show stage timings"""
+    if update.message.chat_id not in admins:
+        update.message.reply_text( 'Not allowed, add the chat id to admin.txt' )
+        return
+
+    rows = stage_stats.summary()
+    if not stage_stats.enabled or rows == []:
+        update.message.reply_text( 'No stage timings' )
+        return
+
+    # milliseconds
+    desc = [ '<code>Command  Stage     Count    Avg    p50    p95    Max</code>' ]
+    for elem in rows:
+        desc.append( f'<code>{elem["command"]:8.8} {elem["stage"]:6.6} {elem["count"]:8d} {elem["mean"]*1000:6.0f} {elem["p50"]*1000:6.0f} {elem["p95"]*1000:6.0f} {elem["max"]*1000:6.0f}</code>' )
+    for text in split_text( '\n'.join( desc ) ):
+        update.message.reply_text( text, parse_mode = "HTML" )
+
+def get_screener_rows( _args ):
+
+    # optional number of rows
+    try:
+        num = int( _args[0] ) if len( _args ) > 0 else _SCREENER_ROWS
+    except ValueError:
+        num = _SCREENER_ROWS
+
+    return max( 1, min( num, _SCREENER_MAX ) )
+
+def queue(update: Update, context: CallbackContext) -> None:
+    """Show outgoing queue statistics"""
+    st    = outbox.stats()
+    text  = f'<code>Depth  : {st["depth"]} ({st["chats"]} chats)</code>\n'
+    text += f'<code>Sent   : {st["sent"]}</code>\n'
+    text += f'<code>Failed : {st["failed"]}</code>\n'
+    text += f'<code>Latency: {st["latency"]:.2f}s avg, {st["max"]:.2f}s max</code>\n'
+    st    = alert_engine.stats()
+    text += f'<code>Alerts : {st["active"]} active in {st["chats"]} chats</code>'
+    if webhook.running():
+        st    = webhook.stats()
+        text += f'\n<code>Updates: {st["depth"]} queued, {st["handled"]} handled, {st["refused"]} refused</code>'
+    update.message.reply_text( text, parse_mode = "HTML" )
 
 def oversold(update: Update, context: CallbackContext) -> None:
-    """Show 10 RSI<40 tickers"""
-    url    = finviz_info[ 'RSI_OVERSOLD(40)' ]
-    result = crawl_finviz_df( url )
-    rsi_dt = dict( zip( result['Ticker'], result['RSI'] ) )
-    desc   = [ f'<code>[{key:5}] {float(val):.1f}</code>' for key, val in rsi_dt.items() ]
-    text   = '\n'.join( desc[:10] )
+    """Show RSI<40 tickers"""
+    num = get_screener_rows( context.args )
+
+    # local screener if a universe is loaded
+    if screener.ready():
+        desc = [ f'<code>[{key:5}] {val["rsi"]:.1f}</code>' for key, val in screener.query( [ ( 'rsi', '<', 40 ) ] ) ]
+    else:
+        url    = finviz_info[ 'RSI_OVERSOLD(40)' ]
+        result = crawl_finviz_df( url, max_rows=num )
+        rsi_dt = dict( zip( result['Ticker'], result['RSI'] ) )
+        desc   = [ f'<code>[{key:5}] {float(val):.1f}</code>' for key, val in rsi_dt.items() ]
+    text = '\n'.join( desc[:num] )
     update.message.reply_text( text, parse_mode = "HTML" )
 
 def overbought(update: Update, context: CallbackContext) -> None:
-    """Show 10 RSI>60 tickers"""
-    url    = finviz_info[ 'RSI_OVERBOUGHT(60)' ]
-    result = crawl_finviz_df( url )
-    rsi_dt = dict( zip( result['Ticker'], result['RSI'] ) )
-    desc   = [ f'<code>[{key:5}] {float(val):.1f}</code>' for key, val in rsi_dt.items() ]
-    text   = '\n'.join( desc[:10] )
+    """Show RSI>60 tickers"""
+    num = get_screener_rows( context.args )
+
+    # local screener if a universe is loaded
+    if screener.ready():
+        desc = [ f'<code>[{key:5}] {val["rsi"]:.1f}</code>' for key, val in screener.query( [ ( 'rsi', '>', 60 ) ] ) ]
+    else:
+        url    = finviz_info[ 'RSI_OVERBOUGHT(60)' ]
+        result = crawl_finviz_df( url, max_rows=num )
+        rsi_dt = dict( zip( result['Ticker'], result['RSI'] ) )
+        desc   = [ f'<code>[{key:5}] {float(val):.1f}</code>' for key, val in rsi_dt.items() ]
+    text = '\n'.join( desc[:num] )
     update.message.reply_text( text, parse_mode = "HTML" )
 
+def screen(update: Update, context: CallbackContext) -> None:
+    """Query local screener"""
+    try:
+        conds, num = parse_screen( context.args )
+        if conds == []: raise ValueError
+    except ValueError:
+        update.message.reply_text( 'Usage: /screen <rsi|cci|day><op><value> ... [<n>]' )
+        return
+
+    if not screener.ready():
+        update.message.reply_text( 'Screener is not loaded, add symbols to universe.txt' )
+        return
+
+    desc = get_screen( screener.query( conds ) )
+    if desc != []:
+        text = '\n'.join( desc[:num] )
+        update.message.reply_text( text, parse_mode = "HTML" )
+    else:
+        update.message.reply_text( "No screened results" )
+
+def refresh_screener(context: CallbackContext) -> None:
+    """Reload universe and recompute screener."""
+    symbols = load_universe()
+    if symbols: screener.load( symbols )
+
+def warm_up():
+
+    warm_modules()
+
+    # last universe bars until the first refresh completes
+    if load_universe() and os.path.isdir( _UNIVERSE_SNAP ) and not screener.ready():
+        screener.build_matrix( PriceMatrix.load( _UNIVERSE_SNAP ) )
+
 # -------------------------------------------------------------------------------------------------
 # Main
 # -------------------------------------------------------------------------------------------------
 
+def add_handlers( _dispatcher, _run_async=True ):
+
+    # on different commands - answer in Telegram
+    _dispatcher.add_handler( CommandHandler("help",       help,       run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("start",      help,       run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("ticker",     ticker,     run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("add",        add,        run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("del",        delete,     run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("run",        runft,      run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("stop",       stop,       run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("filter",     filter,     run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("thres",      thres,      run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("set",        setthr,     run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("price",      price,      run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("pre",        pre,        run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("post",       post,       run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("rsi",        rsi,        run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("draw",       draw,       run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("info",       info,       run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("index",      index,      run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("sector",     sector,     run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("job",        job,        run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("cache",      cache,      run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("queue",      queue,      run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("oversold",   oversold,   run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("overbought", overbought, run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("screen",     screen,     run_async=_run_async ) )
+    _dispatcher.add_handler( CommandHandler("stats",      stats,      run_async=_run_async ) )
+
+    # time every command
+    for handler in _dispatcher.handlers[0]:
+        handler.callback = stage_stats.wrap( handler.command[0], handler.callback )
+
 def main():
 
-    global params
+    parser = argparse.ArgumentParser( description='Financial alert telegram bot' )
+    parser.add_argument( '--shards', type=int, default=_SHARDS, help='worker processes for metrics and charts' )
+    parser.add_argument( '--webhook', metavar='URL', help='receive updates on this public url instead of polling' )
+    parser.add_argument( '--host', default=_WEBHOOK_HOST, help='local address of the webhook server' )
+    parser.add_argument( '--port', type=int, default=_WEBHOOK_PORT, help='local port of the webhook server' )
+    args = parser.parse_args()
 
     # load token
     try:
@@ -758,42 +3310,73 @@ def main():
         print( 'Make token.txt which includes your token value' )
         exit()
 
-    # check if param file exists
-    if os.path.isfile( _PARAM_FILE ): params=load_params()
-    else: save_params( params )
+    # legacy param file provides defaults for new chats
+    if os.path.isfile( _PARAM_FILE ): params.update( load_params() )
+
+    # /stats is limited to these chats
+    admins.update( load_admins() )
+
+    # /run pauses on exchange holidays
+    holidays.update( load_holidays() )
+
+    # metrics and charts in worker processes
+    if args.shards > 0: start_shards( args.shards )
 
     """Run bot."""
     # Create the Updater and pass it your bot's token.
-    updater = Updater( token )
+    updater = Updater( token, workers=_WORKERS )
 
     # Get the dispatcher to register handlers
     dispatcher = updater.dispatcher
 
-    # on different commands - answer in Telegram
-    dispatcher.add_handler( CommandHandler("help",       help       ) )
-    dispatcher.add_handler( CommandHandler("start",      help       ) )
-    dispatcher.add_handler( CommandHandler("ticker",     ticker     ) )
-    dispatcher.add_handler( CommandHandler("add",        add        ) )
-    dispatcher.add_handler( CommandHandler("del",        delete     ) )
-    dispatcher.add_handler( CommandHandler("run",        runft      ) )
-    dispatcher.add_handler( CommandHandler("stop",       stop       ) )
-    dispatcher.add_handler( CommandHandler("filter",     filter     ) )
-    dispatcher.add_handler( CommandHandler("thres",      thres      ) )
-    dispatcher.add_handler( CommandHandler("set",        setthr     ) )
-    dispatcher.add_handler( CommandHandler("price",      price      ) )
-    dispatcher.add_handler( CommandHandler("pre",        pre        ) )
-    dispatcher.add_handler( CommandHandler("post",       post       ) )
-    dispatcher.add_handler( CommandHandler("rsi",        rsi        ) )
-    dispatcher.add_handler( CommandHandler("draw",       draw       ) )
-    dispatcher.add_handler( CommandHandler("info",       info       ) )    
-    dispatcher.add_handler( CommandHandler("index",      index      ) )
-    dispatcher.add_handler( CommandHandler("sector",     sector     ) )
-    dispatcher.add_handler( CommandHandler("job",        job        ) )
-    dispatcher.add_handler( CommandHandler("oversold",   oversold   ) )
-    dispatcher.add_handler( CommandHandler("overbought", overbought ) )
-
-    # Start the Bot
-    updater.start_polling()
+    # webhook workers run handlers themselves, polling hands them to the dispatcher pool
+    add_handlers( dispatcher, _run_async=not args.webhook )
+
+    # prometheus endpoint
+    if _STATS_PORT is not None: start_metrics_server( _STATS_PORT )
+
+    # local screener, refreshed in the background
+    if load_universe():
+        updater.job_queue.run_repeating( refresh_screener, _UNIVERSE_REFRESH, first=0, name=_UNIVERSE_JOB )
+
+    # alerts are delivered through the outbox
+    outbox.start( updater.bot )
+
+    # pushed quotes, ticks re-run the scan for chats watching them
+    if _FEED_ADDR is not None:
+        tick_trigger.start()
+        quote_feed.start( _FEED_ADDR )
+
+    if args.webhook:
+        # a tls proxy forwards the public url to the local server
+        path   = urlparse( args.webhook ).path or '/'
+        secret = secrets.token_urlsafe( 32 )
+        webhook.start( dispatcher, ( args.host, args.port ), path, secret )
+        updater.job_queue.start()
+        try:
+            updater.bot.set_webhook( args.webhook, max_connections=_WEBHOOK_WORKERS, secret_token=secret,
+                                     allowed_updates=[ 'message', 'edited_message' ] )
+        except TelegramError as e:
+            # no update would ever arrive
+            print( f'set_webhook failed: {e}' )
+            webhook.stop()
+            updater.job_queue.stop()
+            sys.exit( 1 )
+    else:
+        # Start the Bot
+        updater.start_polling()
+
+    # heavy imports and the screener snapshot, while updates are already served
+    threading.Thread( target=warm_up, name='warm', daemon=True ).start()
+
+    if args.webhook:
+        # until Ctrl-C, telegram keeps retrying updates while we are down
+        try:
+            while True: time.sleep( 1 )
+        except KeyboardInterrupt:
+            webhook.stop()
+            updater.job_queue.stop()
+        return
 
     # Block until you press Ctrl-C or the process receives SIGINT, SIGTERM or
     # SIGABRT. This should be used most of the time, since start_polling() is
@@ -0,0 +1,94 @@
+#
+# Quote feed replay
+#
+
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+
+_FIXTURE = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'fixtures', 'quotes.jsonl' )
+
+# -------------------------------------------------------------------------------------------------
+# Server
+# -------------------------------------------------------------------------------------------------
+
+def load_ticks( _path ):
+
+    # one tick per line, 't' is seconds from the start of the recording
+    with open( _path, 'r' ) as fp:
+        return [ json.loads( line ) for line in fp if line.strip() ]
+
+class ReplayHandler( socketserver.StreamRequestHandler ):
+    """Streams the recorded ticks of subscribed symbols to one client."""
+
+    def setup( self ):
+        super().setup()
+        self.symbols = set()
+        self.lock    = threading.Lock()
+
+    def read( self ):
+        # { "subscribe": [ symbols ] } lines, '*' subscribes to everything
+        for line in self.rfile:
+            try:
+                msg = json.loads( line )
+            except ValueError:
+                continue
+            with self.lock:
+                self.symbols |= set( msg.get( 'subscribe', [] ) )
+
+    def handle( self ):
+        threading.Thread( target=self.read, daemon=True ).start()
+
+        while True:
+            start = time.monotonic()
+            for tick in self.server.ticks:
+                wait = start + tick['t'] / self.server.speed - time.monotonic()
+                if wait > 0: time.sleep( wait )
+
+                with self.lock:
+                    wanted = '*' in self.symbols or tick['symbol'] in self.symbols
+                if not wanted: continue
+
+                msg = { key: val for key, val in tick.items() if key != 't' }
+                msg['sent'] = time.time()
+                try:
+                    self.wfile.write( ( json.dumps( msg ) + '\n' ).encode() )
+                    self.wfile.flush()
+                except OSError:
+                    return
+            if not self.server.loop: return
+
+class ReplayServer( socketserver.ThreadingTCPServer ):
+
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__( self, addr, ticks, speed=1.0, loop=False ):
+        super().__init__( addr, ReplayHandler )
+        self.ticks = ticks
+        self.speed = speed
+        self.loop  = loop
+
+# -------------------------------------------------------------------------------------------------
+# Main
+# -------------------------------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser( description='replay recorded quotes as a ftgram quote feed' )
+    parser.add_argument( 'path', nargs='?', default=_FIXTURE, help='recorded ticks, one json per line' )
+    parser.add_argument( '--host', default='127.0.0.1' )
+    parser.add_argument( '--port', type=int, default=8765 )
+    parser.add_argument( '--speed', type=float, default=1.0, help='replay speed factor' )
+    parser.add_argument( '--loop', action='store_true', help='start over at the end' )
+    args = parser.parse_args()
+
+    server = ReplayServer( ( args.host, args.port ), load_ticks( args.path ), args.speed, args.loop )
+    print( f'replaying {args.path} on {args.host}:{args.port}' )
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()